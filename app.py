@@ -1,33 +1,101 @@
-import json
+import functools
+import mmap
 import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import gradio as gr
-import pandas as pd
+import orjson
 
 # ベースディレクトリのパス
 BASE_DIR = "/nas/k_ishikawa/datasets/HappyRat/synthesis"
 JSON_SUBDIR = "evaluation/illogical/jsons"
 
-# 現在のファイルインデックスをグローバル変数として保持
-current_file_index = 0
+# UIテーマ（create_interfaceの度に作り直さない）
+SOFT_THEME = gr.themes.Soft()
+
+# ディレクトリ一覧キャッシュの有効期間（秒）と保持するiteration数の上限
+LISTING_TTL = 60.0
+LISTING_CACHE_SIZE = 32
+# 解析済みJSONを保持する件数
+PARSE_CACHE_SIZE = 256
+# 同じ方向に何回連続で移動したら先読みを始めるか、何件先まで読むか
+PREFETCH_AFTER = 2
+PREFETCH_DEPTH = 2
+# このサイズ以上のJSONはmmapして読み込む
+MMAP_THRESHOLD = 1 << 20
+# iteration切り替え時に全ファイルを読み込む並列数
+WARMUP_WORKERS = 8
+
+# NAS上のlistdirを毎クリック実行しないよう、ソート済み一覧を保持する
+# （一覧はtupleで保持し、呼び出し側で並べ替えや変更が起きないようにする）
+_files_cache: OrderedDict[str, tuple[float, tuple[str, ...]]] = OrderedDict()
+_iter_cache: dict[str, tuple[float, tuple[str, ...]]] = {}
+
+# 前後移動中に次のファイルを先読みするスレッドプール
+_prefetch_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="prefetch")
+_warmup_executor = ThreadPoolExecutor(
+    max_workers=WARMUP_WORKERS, thread_name_prefix="warmup"
+)
+
+
+def _cache_get(cache, key):
+    """TTL内であればキャッシュ済みの一覧を返す"""
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    ts, value = entry
+    if time.monotonic() - ts >= LISTING_TTL:
+        del cache[key]
+        return None
+    if isinstance(cache, OrderedDict):
+        cache.move_to_end(key)
+    return value
+
+
+def _cache_put(cache, key, value):
+    """一覧をキャッシュに保存（OrderedDictの場合はLRUで上限を保つ）"""
+    cache[key] = (time.monotonic(), value)
+    if isinstance(cache, OrderedDict):
+        cache.move_to_end(key)
+        while len(cache) > LISTING_CACHE_SIZE:
+            cache.popitem(last=False)
+    return value
+
+
+def forget_listing(iteration=None):
+    """ディレクトリ一覧のキャッシュを破棄（iteration指定時はそのファイル一覧のみ）"""
+    if iteration is None:
+        _files_cache.clear()
+        _iter_cache.clear()
+    else:
+        _files_cache.pop(iteration, None)
 
 
 def get_iteration_dirs():
     """利用可能なiterationディレクトリのリストを取得"""
-    iter_dirs = []
-    if os.path.exists(BASE_DIR):
-        for item in os.listdir(BASE_DIR):
-            item_path = os.path.join(BASE_DIR, item)
-            if os.path.isdir(item_path):
-                # estimation/satisfaction/jsonsが存在するかチェック
-                json_path = os.path.join(item_path, JSON_SUBDIR)
-                if os.path.exists(json_path):
-                    iter_dirs.append(item)
-        iter_dirs.sort()  # ソート
-    return iter_dirs
-
+    cached = _cache_get(_iter_cache, BASE_DIR)
+    if cached is not None:
+        return cached
 
+    iter_dirs = []
+    if os.path.isdir(BASE_DIR):
+        # DirEntry.is_dir()はreaddirの結果を使うため、通常は追加のstatが不要
+        # (シンボリックリンクのiterationも従来どおり辿って一覧に含める)
+        with os.scandir(BASE_DIR) as it:
+            for entry in it:
+                if not entry.is_dir():
+                    continue
+                # evaluation/illogical/jsonsが存在するかチェック
+                if os.path.isdir(get_json_dir(entry.name)):
+                    iter_dirs.append(entry.name)
+    # ソートは一覧を読み直した時だけ行う
+    return _cache_put(_iter_cache, BASE_DIR, tuple(sorted(iter_dirs)))
+
+
+@functools.cache
 def get_json_dir(iteration):
     """指定されたiterationのJSONディレクトリパスを取得"""
     return os.path.join(BASE_DIR, iteration, JSON_SUBDIR)
@@ -35,12 +103,66 @@ def get_json_dir(iteration):
 
 def get_json_files(iteration="iter_0"):
     """JSONファイルのリストを取得"""
+    cached = _cache_get(_files_cache, iteration)
+    if cached is not None:
+        return cached
+
     json_dir = get_json_dir(iteration)
-    json_files = []
-    if os.path.exists(json_dir):
-        json_files = [f for f in os.listdir(json_dir) if f.endswith(".json")]
-        json_files.sort()  # ファイル名でソート
-    return json_files
+    json_files = ()
+    if os.path.isdir(json_dir):
+        with os.scandir(json_dir) as it:
+            json_files = tuple(
+                sorted(
+                    entry.name
+                    for entry in it
+                    if entry.name.endswith(".json") and entry.is_file()
+                )
+            )
+    return _cache_put(_files_cache, iteration, json_files)
+
+
+def _read_json(filepath):
+    """JSONファイルを読み込んで解析（大きなファイルはmmap経由でコピーせずに渡す）"""
+    with open(filepath, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < MMAP_THRESHOLD:
+            return orjson.loads(f.read())
+        with mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ) as mm:
+            # 先頭から順に読むため、カーネルの先読みを促す
+            mm.madvise(mmap.MADV_SEQUENTIAL)
+            with memoryview(mm) as buf:
+                return orjson.loads(buf)
+
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse_json_file(filename, iteration):
+    """JSONファイルを解析して表示用データを返す（結果はキャッシュされる）"""
+    # パスはPOSIX前提のため、解決済みディレクトリにそのまま連結する
+    filepath = get_json_dir(iteration) + "/" + filename
+    data = _read_json(filepath)
+
+    # Messages データを抽出（nameとutteranceのみ、他のキーは参照しない）
+    # gr.Dataframeは行のリストをそのまま受け付けるため、pandasを経由しない
+    raw_messages = data.get("messages") or ()
+    try:
+        # 通常はname/utteranceが必ずあるため、.get()を使わず直接参照する
+        messages = [[msg["name"], msg["utterance"]] for msg in raw_messages]
+    except KeyError:
+        messages = [
+            [msg.get("name", ""), msg.get("utterance", "")] for msg in raw_messages
+        ]
+
+    # 他のフィールドを抽出（表示する項目は固定なので、束縛済みのgetで直接取り出す）
+    get = data.get
+    return (
+        messages,
+        get("scene", ""),
+        get("reason", ""),
+        get("chosen", ""),
+        get("rejected", ""),
+        str(get("score", "")),
+        get("speaker", ""),
+    )
 
 
 def load_json_data(filename, iteration="iter_0"):
@@ -48,90 +170,123 @@ def load_json_data(filename, iteration="iter_0"):
     if not filename:
         return None, None, "", "", "", "", ""
 
-    json_dir = get_json_dir(iteration)
-    filepath = os.path.join(json_dir, filename)
     try:
-        with open(filepath, "r", encoding="utf-8") as f:
-            data = json.load(f)
-
-        # Messages データを抽出（nameとutteranceのみ）
-        messages_data = []
-        if "messages" in data:
-            for msg in data["messages"]:
-                name = msg.get("name", "")
-                utterance = msg.get("utterance", "")
-                messages_data.append({"name": name, "utterance": utterance})
-
-        # DataFrameに変換
-        df = pd.DataFrame(messages_data) if messages_data else pd.DataFrame()
-
-        # 他のフィールドを抽出
-        reason = data.get("reason", "")
-        chosen = data.get("chosen", "")
-        rejected = data.get("rejected", "")
-        score = str(data.get("score", ""))
-        speaker = data.get("speaker", "")
-        scene = data.get("scene", "")
-
-        return df, scene, reason, chosen, rejected, score, speaker
-
+        # Gradioは返した行リストを変更しないため、キャッシュをそのまま返す
+        return _parse_json_file(filename, iteration)
     except Exception as e:
+        # 読み込みエラーはキャッシュせず、次回再試行する
         return None, None, f"Error loading file: {str(e)}", "", "", "", ""
 
 
-def get_current_file_data(iteration="iter_0"):
+def new_view_state(iteration):
+    """セッションごとの閲覧状態（iteration、インデックス、ファイル一覧）を作成"""
+    return {
+        "iter": iteration,
+        "idx": 0,
+        "files": get_json_files(iteration),
+        # 同じ方向への連続移動（先読みの判定に使用）
+        "step": 0,
+        "run": 0,
+        # 直前に画面へ送った内容（変更のない項目の再送を省くために使用）
+        "shown": None,
+    }
+
+
+def get_current_file_data(state):
     """現在のファイルインデックスに基づいてデータを取得"""
-    json_files = get_json_files(iteration)
-    if (
-        not json_files
-        or current_file_index < 0
-        or current_file_index >= len(json_files)
-    ):
+    json_files = state["files"]
+    index = state["idx"]
+    if not json_files or index < 0 or index >= len(json_files):
         return "", None, None, "", "", "", "", ""
 
-    current_filename = json_files[current_file_index]
-    df, scene, reason, chosen, rejected, score, speaker = load_json_data(
-        current_filename, iteration
+    current_filename = json_files[index]
+    messages, scene, reason, chosen, rejected, score, speaker = load_json_data(
+        current_filename, state["iter"]
+    )
+    return current_filename, messages, scene, reason, chosen, rejected, score, speaker
+
+
+def prefetch_ahead(state, step):
+    """同じ方向へ連続して移動している場合、その先のファイルを裏で読み込む"""
+    if state["step"] == step:
+        state["run"] += 1
+    else:
+        state["step"] = step
+        state["run"] = 1
+    if state["run"] < PREFETCH_AFTER:
+        return
+
+    json_files = state["files"]
+    for offset in range(1, PREFETCH_DEPTH + 1):
+        index = state["idx"] + step * offset
+        if 0 <= index < len(json_files):
+            _prefetch_executor.submit(load_json_data, json_files[index], state["iter"])
+
+
+def warm_parse_cache(state):
+    """iteration内の全ファイルを裏でまとめて読み込み、解析キャッシュを温める"""
+    json_files = state["files"]
+    # キャッシュに収まらない件数の場合は、読み込んでも追い出されるだけなので行わない
+    if len(json_files) > PARSE_CACHE_SIZE:
+        return
+    for filename in json_files:
+        _warmup_executor.submit(load_json_data, filename, state["iter"])
+
+
+def diff_outputs(state, data):
+    """前回表示した内容と同じ項目はgr.update()（変更なし）にして送信量を減らす"""
+    shown = state["shown"]
+    state["shown"] = data
+    if shown is None:
+        return data
+    return tuple(
+        gr.update() if new is old or new == old else new
+        for new, old in zip(data, shown)
     )
-    return current_filename, df, scene, reason, chosen, rejected, score, speaker
 
 
-def navigate_to_previous(iteration):
+def navigate_to_previous(state):
     """前のファイルに移動"""
-    global current_file_index
-    json_files = get_json_files(iteration)
-    if json_files and current_file_index > 0:
-        current_file_index -= 1
-    return get_current_file_data(iteration)
+    if state["files"] and state["idx"] > 0:
+        state["idx"] -= 1
+    prefetch_ahead(state, -1)
+    return state, *diff_outputs(state, get_current_file_data(state))
 
 
-def navigate_to_next(iteration):
+def navigate_to_next(state):
     """次のファイルに移動"""
-    global current_file_index
-    json_files = get_json_files(iteration)
-    if json_files and current_file_index < len(json_files) - 1:
-        current_file_index += 1
-    return get_current_file_data(iteration)
+    if state["files"] and state["idx"] < len(state["files"]) - 1:
+        state["idx"] += 1
+    prefetch_ahead(state, 1)
+    return state, *diff_outputs(state, get_current_file_data(state))
 
 
 def refresh_files(iteration):
     """ファイルリストを更新し、最初のファイルに戻る"""
-    global current_file_index
-    current_file_index = 0
-    return get_current_file_data(iteration)
+    forget_listing()
+    _parse_json_file.cache_clear()
+    state = new_view_state(iteration)
+    data = diff_outputs(state, get_current_file_data(state))
+    warm_parse_cache(state)
+    return state, *data
 
 
 def on_iteration_change(iteration):
     """iterationが変更された時の処理"""
-    global current_file_index
-    current_file_index = 0
-    return get_current_file_data(iteration)
+    forget_listing(iteration)
+    state = new_view_state(iteration)
+    data = diff_outputs(state, get_current_file_data(state))
+    warm_parse_cache(state)
+    return state, *data
 
 
 def create_interface():
     """Gradioインターフェースを作成"""
+    # ディレクトリ一覧は1度だけ取得し、ドロップダウンと初期表示で共有する
+    available_dirs = get_iteration_dirs()
+    initial_dir = available_dirs[0] if available_dirs else None
 
-    with gr.Blocks(title="JSON サンプル ビューア", theme=gr.themes.Soft()) as app:
+    with gr.Blocks(title="JSON サンプル ビューア", theme=SOFT_THEME) as app:
         gr.Markdown("# 📄 JSON サンプル ビューア")
         gr.Markdown("指定されたディレクトリのJSONファイルを確認できます。")
 
@@ -156,6 +311,7 @@ def create_interface():
             # メッセージ表示
             messages_dataframe = gr.Dataframe(
                 headers=["name", "utterance"],
+                datatype=["str", "str"],
                 label="メッセージ (Messages)",
                 interactive=False,
                 wrap=True,
@@ -193,17 +349,21 @@ def create_interface():
 
         with gr.Row():
             # ディレクトリ選択
-            available_dirs = get_iteration_dirs()
-            initial_dir = available_dirs[0] if available_dirs else None
             iteration_dropdown = gr.Dropdown(
                 label="ディレクトリ",
-                choices=available_dirs,
+                choices=list(available_dirs),
                 value=initial_dir,
                 interactive=True,
             )
 
+        # 初期データ読み込み
+        initial_state = new_view_state(initial_dir or "iter_0")
+        # セッションごとの閲覧状態（gr.Stateはセッション毎に初期値を複製する）
+        view_state = gr.State(initial_state)
+
         # イベントハンドラー
         outputs = [
+            view_state,
             current_file_textbox,
             messages_dataframe,
             scene_textbox,
@@ -215,12 +375,8 @@ def create_interface():
         ]
 
         # ボタンイベント
-        prev_btn.click(
-            fn=navigate_to_previous, inputs=[iteration_dropdown], outputs=outputs
-        )
-        next_btn.click(
-            fn=navigate_to_next, inputs=[iteration_dropdown], outputs=outputs
-        )
+        prev_btn.click(fn=navigate_to_previous, inputs=[view_state], outputs=outputs)
+        next_btn.click(fn=navigate_to_next, inputs=[view_state], outputs=outputs)
         refresh_btn.click(
             fn=refresh_files, inputs=[iteration_dropdown], outputs=outputs
         )
@@ -228,30 +384,11 @@ def create_interface():
             fn=on_iteration_change, inputs=[iteration_dropdown], outputs=outputs
         )
 
-        # 初期データ読み込み
-        available_dirs = get_iteration_dirs()
-        initial_iteration = available_dirs[0] if available_dirs else "iter_0"
-        json_files = get_json_files(initial_iteration)
-        if json_files:
-            (
-                initial_filename,
-                initial_df,
-                initial_scene,
-                initial_reason,
-                initial_chosen,
-                initial_rejected,
-                initial_score,
-                initial_speaker,
-            ) = get_current_file_data(initial_iteration)
-
-            current_file_textbox.value = initial_filename
-            messages_dataframe.value = initial_df
-            scene_textbox.value = initial_scene
-            reason_textbox.value = initial_reason
-            chosen_textbox.value = initial_chosen
-            rejected_textbox.value = initial_rejected
-            score_textbox.value = initial_score
-            speaker_textbox.value = initial_speaker
+        # 初期表示もハンドラと同じ経路（解析キャッシュ）で取得する
+        initial_state["shown"] = get_current_file_data(initial_state)
+        for component, value in zip(outputs[1:], initial_state["shown"]):
+            component.value = value
+        warm_parse_cache(initial_state)
 
     return app
 
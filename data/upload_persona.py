@@ -1,7 +1,14 @@
 if __name__ == "__main__":
+    import os
+
     from datasets import load_dataset
 
-    ds = load_dataset("json", data_files="data/personas/persona_*.json", split="train")
+    ds = load_dataset(
+        "json",
+        data_files="data/personas/persona_*.json",
+        split="train",
+        num_proc=os.cpu_count(),
+    )
 
     print(ds)
 
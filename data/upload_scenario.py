@@ -6,6 +6,7 @@ uv run data/upload_scenario.py --subset app --dir data/scenarios_app
 
 if __name__ == "__main__":
     import argparse
+    import os
 
     from datasets import load_dataset
 
@@ -14,9 +15,20 @@ if __name__ == "__main__":
     parser.add_argument("--dir", type=str, default="data/scenarios")
     args = parser.parse_args()
 
+    num_proc = os.cpu_count()
     ds = load_dataset(
-        "json", data_files=f"{args.dir}/scenario_*.json", split="train"
-    ).map(lambda x: {"character_list": x["metadata"]["character_list"]})
+        "json",
+        data_files=f"{args.dir}/scenario_*.json",
+        split="train",
+        num_proc=num_proc,
+    ).map(
+        lambda batch: {
+            "character_list": [m["character_list"] for m in batch["metadata"]]
+        },
+        batched=True,
+        batch_size=1000,
+        num_proc=num_proc,
+    )
 
     print(ds)
 
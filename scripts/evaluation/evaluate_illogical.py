@@ -1,18 +1,79 @@
 """Conversation quality evaluation using the new evaluation framework."""
 
 import argparse
-import json
+import asyncio
+import functools
+import itertools
 import os
+import random
+from collections.abc import Iterator
 from pathlib import Path
-from typing import Any, Literal
+from typing import Any, Literal, TypedDict
 
-from datasets import load_dataset
+import orjson
 from loguru import logger
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
 
 from spalign.evaluation.base import BaseEvaluator, EvaluationConfig, LLMConfig
 from spalign.projects.happyrat.profiles import CHARACTERS
-from spalign.utils import extract_next_speaker
+from spalign.utils import extract_next_speaker, strip_tags
+
+# Local prefilter: a character whose consecutive utterances share few 3-grams
+# and are all reasonably long is scored 5 without an LLM call
+PREFILTER_MAX_REPETITION = 0.1
+PREFILTER_MIN_LENGTH = 15
+PREFILTER_AUDIT_RATE = 0.05
+
+# Known character names, for cheap membership tests in per-message loops
+_CHARACTER_NAMES: frozenset[str] = frozenset(CHARACTERS)
+# Flat per-character lookups, materialized once at import
+_TAGS: dict[str, str] = {name: c["tag"] for name, c in CHARACTERS.items()}
+_PROFILES: dict[str, str] = {name: c["profile"] for name, c in CHARACTERS.items()}
+
+
+class _Msg(TypedDict):
+    name: str
+    utterance: str
+
+
+# Validates a whole message list in one pass through pydantic-core
+_MSG_LIST = TypeAdapter(list[_Msg])
+
+
+def _char_ngrams(text: str, n: int = 3) -> set[str]:
+    return {text[i : i + n] for i in range(len(text) - n + 1)}
+
+
+def _repetition_score(utterances: list[str]) -> float:
+    """Highest character 3-gram Jaccard similarity of consecutive utterances."""
+    score = 0.0
+    prev: set[str] = set()
+    for utterance in utterances:
+        grams = _char_ngrams(utterance)
+        if prev and grams:
+            score = max(score, len(prev & grams) / len(prev | grams))
+        prev = grams
+    return score
+
+
+def _validate_messages(messages: Any) -> bool:
+    """Check that `messages` is a list of name/utterance string dicts."""
+    try:
+        _MSG_LIST.validate_python(messages)
+    except ValidationError as e:
+        logger.error(f"Malformed conversation messages: {e}")
+        return False
+    return True
+
+
+def _speaking_characters(messages: list[dict[str, Any]]) -> list[str]:
+    """Known characters that speak in `messages`, via one C-level set pass."""
+    return list(_CHARACTER_NAMES.intersection([m["name"] for m in messages]))
+
+
+@functools.lru_cache(maxsize=4096)
+def _next_speaker(utterance: str) -> str:
+    return extract_next_speaker(utterance)
 
 
 class CharacterUtteranceCorrection(BaseModel):
@@ -126,119 +187,120 @@ You are an expert conversation quality evaluator. Based on the provided "Charact
 class QualityEvaluator(BaseEvaluator[ConversationEvaluation]):
     """Evaluator for conversation quality assessment."""
 
+    def __init__(
+        self,
+        config: EvaluationConfig[ConversationEvaluation],
+        run_name: str,
+        prefilter: bool = False,
+        audit_rate: float = PREFILTER_AUDIT_RATE,
+        jsonl: bool = False,
+    ):
+        super().__init__(config, run_name)
+        self.prefilter = prefilter
+        self.audit_rate = audit_rate
+        self.jsonl = jsonl
+        # (session_id, character) pairs the prefilter passed but sent to the
+        # LLM as audits, and how often the LLM disagreed with the prefilter
+        self._audited: set[tuple[str, str]] = set()
+        self.audit_count = 0
+        self.audit_misses = 0
+
+    def shortcut_response(
+        self, entry: dict[str, Any], character: str
+    ) -> ConversationEvaluation | None:
+        if not self.prefilter:
+            return None
+        utterances = [
+            strip_tags(m["utterance"])
+            for m in entry["conversations"]
+            if m["name"] == character
+        ]
+        if (
+            not utterances
+            or min(map(len, utterances)) <= PREFILTER_MIN_LENGTH
+            or _repetition_score(utterances) >= PREFILTER_MAX_REPETITION
+        ):
+            return None
+        # Still send a small sample to the LLM to audit the prefilter
+        if random.random() < self.audit_rate:
+            self._audited.add((entry["id"], character))
+            return None
+        return ConversationEvaluation(score=5, corrections=[])
+
     # We need to add scene_instruction to the format call in the base class.
     # For now, we add a placeholder method here.
 
     def format_messages(self, messages: list[dict[str, Any]]) -> str:
-        lines = []
-        try:
-            for i, m in enumerate(messages):
-                try:
-                    if not isinstance(m, dict):
-                        logger.error(f"Message {i} is not a dict: {type(m)} - {m}")
-                        lines.append(f"(index={i}) ERROR: Invalid message format")
-                        continue
-
-                    if "name" not in m:
-                        logger.error(f"Message {i} missing 'name' field: {m.keys()}")
-                        lines.append(f"(index={i}) ERROR: Missing name field")
-                        continue
-
-                    if "utterance" not in m:
-                        logger.error(
-                            f"Message {i} missing 'utterance' field: {m.keys()}"
-                        )
-                        lines.append(f"(index={i}) ERROR: Missing utterance field")
-                        continue
-
-                    if m["name"] in CHARACTERS.keys():
-                        speaker = m["name"]
-                    else:
-                        speaker = "ユーザー"
-                    lines.append(f"(index={i}) {speaker}: {m['utterance']}")
-
-                except Exception as e:
-                    logger.error(f"Error processing message {i}: {e}")
-                    import traceback
-
-                    logger.error(
-                        f"Message processing traceback: {traceback.format_exc()}"
-                    )
-                    lines.append(f"(index={i}) ERROR: {str(e)}")
-
-        except Exception as e:
-            logger.error(f"Fatal error in format_messages: {e}")
-            import traceback
-
-            logger.error(f"Format messages traceback: {traceback.format_exc()}")
-            return f"ERROR: Could not format messages - {str(e)}"
-
-        return "\n".join(lines)
+        # Messages were validated once at load time (see iter_conversations)
+        names = _CHARACTER_NAMES
+        out = [""] * len(messages)
+        for i, m in enumerate(messages):
+            name = m["name"]
+            speaker = name if name in names else "ユーザー"
+            out[i] = "(index=" + str(i) + ") " + speaker + ": " + m["utterance"]
+        return "\n".join(out)
 
     def get_characters_from_entry(self, entry: dict[str, Any]) -> list[str]:
-        characters_set: set[str] = set()
-        try:
+        # Precomputed once per record by iter_conversations
+        characters = entry.get("_characters")
+        if characters is None:
             conversations = entry.get("conversations", [])
             if not conversations:
                 logger.warning("Entry has no conversations")
                 return []
+            characters = _speaking_characters(conversations)
 
-            for i, c in enumerate(conversations):
-                try:
-                    if not isinstance(c, dict):
-                        logger.error(f"Conversation {i} is not a dict: {type(c)}")
-                        continue
-
-                    if "name" not in c:
-                        logger.error(
-                            f"Conversation {i} missing 'name' field: {c.keys()}"
-                        )
-                        continue
-
-                    if c["name"] in CHARACTERS.keys():
-                        characters_set.add(c["name"])
-
-                except Exception as e:
-                    logger.error(
-                        f"Error processing conversation {i} in get_characters_from_entry: {e}"
-                    )
-                    import traceback
-
-                    logger.error(
-                        f"Character extraction traceback: {traceback.format_exc()}"
-                    )
-
-        except Exception as e:
-            logger.error(f"Fatal error in get_characters_from_entry: {e}")
-            import traceback
-
-            logger.error(
-                f"Character extraction fatal traceback: {traceback.format_exc()}"
-            )
-
-        result = list(characters_set)
-        # logger.debug(f"Extracted characters: {result}")
-        if not result:
+        if not characters:
             logger.warning(
                 f"No characters found in entry: {entry.get('session_id', 'N/A')}"
             )
             return ["dummy_character"]  # Return a dummy to prevent index errors
-        return result
+        return characters
 
     def get_character_profile(self, character: str) -> str:
-        if character not in CHARACTERS:
+        profile = _PROFILES.get(character)
+        if profile is None:
             logger.warning(
                 f"Character '{character}' not found in CHARACTERS dict. Returning empty profile."
             )
             return "No profile available for this character."
-        return CHARACTERS[character]["profile"]
+        return profile
 
     def get_scene_instruction(self, entry: dict[str, Any]) -> str:
         return entry.get("scenario", "No specific scene setting provided.")
 
+    def replay_response(self, raw: str | bytes) -> ConversationEvaluation:
+        # Cached responses were validated when stored; rebuild without
+        # re-running field validation.
+        obj = orjson.loads(raw)
+        return ConversationEvaluation.model_construct(
+            score=obj["score"],
+            corrections=[
+                CharacterUtteranceCorrection.model_construct(**c)
+                for c in obj["corrections"]
+            ],
+        )
+
     def process_response(
         self, response: ConversationEvaluation, entry: dict[str, Any], character: str
     ) -> tuple[int, list[dict[str, Any]]]:
+        key = (entry["id"], character)
+        if key in self._audited:
+            self._audited.discard(key)
+            self.audit_count += 1
+            # The prefilter would have scored this 5 without asking the LLM
+            if response.score <= 3:
+                self.audit_misses += 1
+                logger.warning(
+                    f"[{entry['id']}] Prefilter audit miss for {character}: "
+                    f"LLM score {response.score} "
+                    f"({self.audit_misses}/{self.audit_count} audits missed)"
+                )
+
+        # The schema only asks for corrections at score 3 or below
+        if response.score >= 4:
+            return 0, []
+
         corrections = []
         conversations_length = len(entry["conversations"])
 
@@ -247,7 +309,7 @@ class QualityEvaluator(BaseEvaluator[ConversationEvaluation]):
                 continue
 
             # Validate index is within valid range
-            if c.index >= conversations_length:
+            if not 0 <= c.index < conversations_length:
                 logger.warning(
                     f"Skipping correction with invalid index {c.index} "
                     f"(conversations length: {conversations_length})"
@@ -269,135 +331,143 @@ class QualityEvaluator(BaseEvaluator[ConversationEvaluation]):
     def save_corrections(
         self, corrections: list[dict[str, Any]], entry: dict[str, Any], session_id: str
     ) -> None:
+        if not corrections:
+            return
+
         try:
-            msgs: list[dict[str, Any]] = []
             conversations = entry.get("conversations", [])
 
             if not conversations:
                 logger.error(f"[{session_id}] No conversations found in entry")
                 return
 
-            # Validate correction indices before processing
-            for i, correction in enumerate(corrections):
-                if correction.get("index") is None:
-                    logger.warning(f"[{session_id}] Correction {i} has None index")
+            # process_response already dropped corrections with a missing or
+            # out-of-range index, so indices are trusted here
+            by_index: dict[int, list[dict[str, Any]]] = {}
+            for correction in corrections:
+                by_index.setdefault(correction["index"], []).append(correction)
+
+            writes = []
+            records: list[dict[str, Any]] = []
+            scene = entry.get("scenario", "")
+            # Visit only the corrected messages, in conversation order
+            for i in sorted(by_index):
+                m = conversations[i]
+                speaker = m["name"]
+                # Check if character exists in CHARACTERS
+                if speaker not in _CHARACTER_NAMES:
+                    logger.error(f"[{session_id}] Unknown character: {speaker}")
                     continue
-                if correction["index"] >= len(conversations):
-                    logger.warning(
-                        f"[{session_id}] Invalid correction index {correction['index']} "
-                        f"(conversations length: {len(conversations)})"
-                    )
 
-            for i, m in enumerate(conversations):
-                try:
-                    # Validate conversation message structure
-                    if not isinstance(m, dict):
-                        logger.error(
-                            f"[{session_id}] Conversation {i} is not a dict: {type(m)}"
+                # Per-message parts shared by every correction of this message
+                tag = _TAGS[speaker]
+                rejected = m["utterance"]
+                next_tag = f"[next:{_next_speaker(rejected)}]"
+                # One shared prefix slice per corrected message
+                prefix = conversations[:i]
+                for correction in by_index[i]:
+                    try:
+                        chosen = (
+                            tag
+                            + f"[emotion:{correction['emotion']}]"
+                            + correction["chosen"]
+                            + next_tag
+                        )
+                        data = {
+                            "scene": scene,
+                            "messages": prefix,
+                            "reason": correction["reason"],
+                            "chosen": chosen,
+                            "rejected": rejected,
+                            "issue_type": correction["issue_type"],
+                            "score": correction["score"],
+                            "speaker": speaker,
+                        }
+                        if self.jsonl:
+                            records.append({"index": correction["index"], **data})
+                            continue
+
+                        sample_path = (
+                            self.output_dir
+                            / f"{session_id}={correction['index']:02d}.json"
                         )
-                        msgs.append(m)
-                        continue
 
-                    if "name" not in m:
-                        logger.error(
-                            f"[{session_id}] Conversation {i} missing 'name' field: {m.keys()}"
+                        future = self._io_pool.submit(
+                            self.write_json, sample_path, data
                         )
-                        msgs.append(m)
-                        continue
+                        writes.append((sample_path, future))
 
-                    if "utterance" not in m:
-                        logger.error(
-                            f"[{session_id}] Conversation {i} missing 'utterance' field: {m.keys()}"
+                    except Exception as e:
+                        logger.opt(exception=True).error(
+                            f"[{session_id}] Error processing correction {correction}: {e}"
                         )
-                        msgs.append(m)
-                        continue
-
-                    for correction in corrections:
-                        try:
-                            # Check if correction index is valid
-                            if correction.get("index") == i and correction[
-                                "index"
-                            ] < len(conversations):
-                                # Check if character exists in CHARACTERS
-                                if m["name"] not in CHARACTERS:
-                                    logger.error(
-                                        f"[{session_id}] Unknown character: {m['name']}"
-                                    )
-                                    continue
-
-                                next_speaker = extract_next_speaker(m["utterance"])
-                                chosen = (
-                                    CHARACTERS[m["name"]]["tag"]
-                                    + f"[emotion:{correction['emotion']}]"
-                                    + correction["chosen"]
-                                    + f"[next:{next_speaker}]"
-                                )
-                                data = {
-                                    "scene": entry.get("scenario", ""),
-                                    "messages": msgs.copy(),
-                                    "reason": correction["reason"],
-                                    "chosen": chosen,
-                                    "rejected": m["utterance"],
-                                    "issue_type": correction["issue_type"],
-                                    "score": correction["score"],
-                                    "speaker": m["name"],
-                                }
-                                sample_path = (
-                                    self.output_dir
-                                    / f"{session_id}={correction['index']:02d}.json"
-                                )
-
-                                try:
-                                    with open(sample_path, "w") as f_json:
-                                        json.dump(
-                                            data,
-                                            f_json,
-                                            indent=2,
-                                            ensure_ascii=False,
-                                            cls=self.DateTimeEncoder,
-                                        )
-                                except Exception as e:
-                                    logger.error(
-                                        f"[{session_id}] Failed to save correction file {sample_path}: {e}"
-                                    )
-
-                        except Exception as e:
-                            logger.error(
-                                f"[{session_id}] Error processing correction {correction}: {e}"
-                            )
-                            import traceback
-
-                            logger.error(
-                                f"[{session_id}] Correction error traceback: {traceback.format_exc()}"
-                            )
-
-                except Exception as e:
-                    logger.error(
-                        f"[{session_id}] Error processing conversation {i}: {e}"
-                    )
-                    import traceback
 
+            if records:
+                # One appended file per session; see split_session_jsonl
+                self.append_jsonl(self.output_dir / f"{session_id}.jsonl", records)
+
+            # Wait for this session's files before its progress is recorded
+            for sample_path, future in writes:
+                if (exc := future.exception()) is not None:
                     logger.error(
-                        f"[{session_id}] Conversation error traceback: {traceback.format_exc()}"
+                        f"[{session_id}] Failed to save correction file {sample_path}: {exc}"
                     )
-                finally:
-                    msgs.append(m)
 
         except Exception as e:
-            logger.error(f"[{session_id}] Fatal error in save_corrections: {e}")
-            import traceback
-
-            logger.error(
-                f"[{session_id}] Fatal error traceback: {traceback.format_exc()}"
+            logger.opt(exception=True).error(
+                f"[{session_id}] Fatal error in save_corrections: {e}"
             )
             raise
 
-    @property
-    def DateTimeEncoder(self) -> type:
-        """Access to DateTimeEncoder for compatibility."""
-        from spalign.evaluation.base import DateTimeEncoder
 
-        return DateTimeEncoder
+def iter_conversations(
+    log_dir: Path, min_messages: int = 5
+) -> Iterator[dict[str, Any]]:
+    """Yield well-formed conversation records with at least `min_messages` messages.
+
+    Reads ``conversations/*.json`` (one record per file) when present and
+    otherwise ``conversations.bak.jsonl`` (one record per line).
+    """
+    conversations_dir = log_dir / "conversations"
+    if conversations_dir.exists():
+        for path in sorted(conversations_dir.glob("*.json")):
+            entry = orjson.loads(path.read_bytes())
+            messages = entry.get("conversations") or ()
+            if len(messages) >= min_messages and _validate_messages(messages):
+                entry["_characters"] = _speaking_characters(messages)
+                yield entry
+    else:
+        with open(log_dir / "conversations.bak.jsonl", "rb", buffering=1 << 20) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = orjson.loads(line)
+                messages = entry.get("conversations") or ()
+                if len(messages) >= min_messages and _validate_messages(messages):
+                    entry["_characters"] = _speaking_characters(messages)
+                    yield entry
+
+
+def split_session_jsonl(output_dir: Path) -> int:
+    """Expand per-session JSONL files into one JSON file per correction.
+
+    Later lines win when a session was appended to more than once. Returns the
+    number of files written.
+    """
+    written = 0
+    for jsonl_path in sorted(output_dir.glob("*.jsonl")):
+        samples: dict[int, dict[str, Any]] = {}
+        with open(jsonl_path, "rb") as f:
+            for line in f:
+                if line.strip():
+                    record = orjson.loads(line)
+                    samples[record.pop("index")] = record
+        for index, record in samples.items():
+            sample_path = output_dir / f"{jsonl_path.stem}={index:02d}.json"
+            BaseEvaluator.write_json(sample_path, record)
+        written += len(samples)
+        jsonl_path.unlink()
+    return written
 
 
 def main() -> None:
@@ -405,7 +475,22 @@ def main() -> None:
         parser = argparse.ArgumentParser()
         parser.add_argument("run_name", type=str)
         parser.add_argument("-n", "--max_items", type=int, default=1000)
-        parser.add_argument("-w", "--max_workers", type=int, default=8)
+        parser.add_argument(
+            "-c",
+            "--max_concurrency",
+            type=int,
+            default=128,
+            help="Maximum number of in-flight LLM requests",
+        )
+        # The old option name is still accepted for existing run scripts
+        parser.add_argument(
+            "-w",
+            "--max_workers",
+            dest="max_concurrency",
+            type=int,
+            default=argparse.SUPPRESS,
+            help="Deprecated alias of --max_concurrency",
+        )
         parser.add_argument(
             "-v", "--verbose", action="store_true", help="Enable debug logging"
         )
@@ -429,6 +514,43 @@ def main() -> None:
             action="store_true",
             help="Use Azure OpenAI instead of Gemini",
         )
+        parser.add_argument(
+            "--base-url",
+            type=str,
+            default=None,
+            help="OpenAI-compatible endpoint (e.g. a vLLM server) to use instead",
+        )
+        parser.add_argument(
+            "--batch",
+            action="store_true",
+            help="Submit all prompts through the Azure OpenAI Batch API",
+        )
+        parser.add_argument(
+            "--no-cache",
+            action="store_true",
+            help="Always call the LLM instead of reusing cached responses",
+        )
+        parser.add_argument(
+            "--prefilter",
+            action="store_true",
+            help="Score clearly non-repetitive characters locally without the LLM",
+        )
+        parser.add_argument(
+            "--audit-rate",
+            type=float,
+            default=PREFILTER_AUDIT_RATE,
+            help="Fraction of prefiltered evaluations still sent to the LLM",
+        )
+        parser.add_argument(
+            "--jsonl",
+            action="store_true",
+            help="Write one JSONL file per session instead of one file per correction",
+        )
+        parser.add_argument(
+            "--split-jsonl",
+            action="store_true",
+            help="Expand per-session JSONL output into per-correction files and exit",
+        )
         args = parser.parse_args()
 
         # Configure logging level
@@ -437,7 +559,9 @@ def main() -> None:
             logger.add(lambda msg: print(msg, end=""), level="DEBUG")
 
         logger.info(f"Starting evaluation for run: {args.run_name}")
-        logger.info(f"Max items: {args.max_items}, Max workers: {args.max_workers}")
+        logger.info(
+            f"Max items: {args.max_items}, Max concurrency: {args.max_concurrency}"
+        )
         logger.info(f"Debug logging: {'enabled' if args.verbose else 'disabled'}")
 
         # Setup LLM configuration
@@ -446,6 +570,7 @@ def main() -> None:
             max_tokens=args.max_tokens,
             max_retries=args.max_retries,
             model=args.model,
+            base_url=args.base_url,
         )
 
         # Setup configuration
@@ -455,10 +580,22 @@ def main() -> None:
             output_dir="evaluation/illogical",
             table_suffix="_quality",
             llm_config=llm_config,
+            response_cache=not args.no_cache,
         )
 
         # Create evaluator
-        evaluator = QualityEvaluator(config, args.run_name)
+        evaluator = QualityEvaluator(
+            config,
+            args.run_name,
+            prefilter=args.prefilter,
+            audit_rate=args.audit_rate,
+            jsonl=args.jsonl,
+        )
+
+        if args.split_jsonl:
+            written = split_session_jsonl(evaluator.output_dir)
+            logger.success(f"Wrote {written} correction files")
+            return
 
         # Load dataset
         log_dir = Path(f"{os.environ['RESULTS_DIR']}/{args.run_name}")
@@ -467,60 +604,45 @@ def main() -> None:
         try:
             if (log_dir / "conversations").exists():
                 logger.info("Loading from conversations directory")
-                dataset = load_dataset(
-                    "json",
-                    data_files=str(log_dir / "conversations" / "*.json"),
-                    split=f"train[:{args.max_items}]",
-                )
             else:
                 logger.info("Loading from conversations.bak.jsonl")
-                dataset = load_dataset(
-                    "json",
-                    data_files=str(log_dir / "conversations.bak.jsonl"),
-                    split=f"train[:{args.max_items}]",
-                )
-        except Exception as e:
-            logger.error(f"Failed to load dataset: {e}")
-            import traceback
-
-            logger.error(f"Dataset loading traceback: {traceback.format_exc()}")
-            raise
-
-        logger.info(f"Dataset loaded with {len(dataset)} entries")
-
-        try:
-            dataset = dataset.filter(lambda x: len(x.get("conversations", [])) >= 5)
-            logger.info(
-                f"Filtered dataset to {len(dataset)} entries (conversations >= 5)"
+            dataset = list(
+                itertools.islice(iter_conversations(log_dir), args.max_items)
             )
         except Exception as e:
-            logger.error(f"Failed to filter dataset: {e}")
-            import traceback
-
-            logger.error(f"Dataset filtering traceback: {traceback.format_exc()}")
+            logger.opt(exception=True).error(f"Failed to load dataset: {e}")
             raise
 
+        logger.info(f"Loaded {len(dataset)} entries (conversations >= 5)")
+
         # Run evaluation
         try:
-            evaluator.run_evaluation(
-                model=args.model,
-                dataset=dataset,
-                max_items=args.max_items,
-                max_workers=args.max_workers,
-                use_azure=args.use_azure,
+            if args.batch:
+                if not args.use_azure:
+                    raise ValueError("--batch requires --use-azure")
+                evaluator.run_batch_evaluation(model=args.model, dataset=dataset)
+                return
+
+            asyncio.run(
+                evaluator.arun_evaluation(
+                    model=args.model,
+                    dataset=dataset,
+                    max_items=args.max_items,
+                    max_concurrency=args.max_concurrency,
+                    use_azure=args.use_azure,
+                )
             )
+            if evaluator.audit_count:
+                logger.info(
+                    f"Prefilter audits: {evaluator.audit_misses}/{evaluator.audit_count} "
+                    "scored 3 or below by the LLM"
+                )
         except Exception as e:
-            logger.error(f"Evaluation failed: {e}")
-            import traceback
-
-            logger.error(f"Evaluation traceback: {traceback.format_exc()}")
+            logger.opt(exception=True).error(f"Evaluation failed: {e}")
             raise
 
     except Exception as e:
-        logger.error(f"Fatal error in main: {e}")
-        import traceback
-
-        logger.error(f"Main function traceback: {traceback.format_exc()}")
+        logger.opt(exception=True).error(f"Fatal error in main: {e}")
         raise
 
 
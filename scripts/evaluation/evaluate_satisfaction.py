@@ -1,18 +1,25 @@
 """User satisfaction evaluation using the new evaluation framework."""
 
 import argparse
-import json
 import os
 from pathlib import Path
 from typing import Any, Literal
 
+import pyarrow.compute as pc
 from datasets import load_dataset
+from langchain_core.output_parsers import PydanticOutputParser
 from pydantic import BaseModel, Field
 
 from spalign.evaluation.base import BaseEvaluator, EvaluationConfig
 from spalign.projects.happyrat.profiles import CHARACTERS
 from spalign.utils import extract_next_speaker
 
+# Known character names, for cheap membership tests in per-message loops
+_CHARACTER_NAMES: frozenset[str] = frozenset(CHARACTERS)
+# Flat per-character lookups, materialized once at import
+_TAGS: dict[str, str] = {name: c["tag"] for name, c in CHARACTERS.items()}
+_PROFILES: dict[str, str] = {name: c["profile"] for name, c in CHARACTERS.items()}
+
 
 class CharacterUtteranceCorrection(BaseModel):
     """Detects character utterances that may have caused dissatisfaction and suggests alternative lines that better match the character."""
@@ -85,24 +92,24 @@ class SatisfactionEvaluator(BaseEvaluator[ConversationSatisfactionEvaluation]):
     """Evaluator for user satisfaction assessment."""
 
     def format_messages(self, messages: list[dict[str, Any]]) -> str:
+        names = _CHARACTER_NAMES
         lines = []
         for i, m in enumerate(messages):
-            if m["name"] in CHARACTERS.keys():
-                speaker = m["name"]
-            else:
-                speaker = "ユーザー"
+            speaker = m["name"] if m["name"] in names else "ユーザー"
             lines.append(f"(index={i}) {speaker}: {m['utterance']}")
         return "\n".join(lines)
 
     def get_characters_from_entry(self, entry: dict[str, Any]) -> list[str]:
-        characters: set[str] = set()
-        for c in entry["conversations"]:
-            if c["name"] in CHARACTERS.keys():
-                characters.add(c["name"])
-        return list(characters)
+        return list(
+            _CHARACTER_NAMES.intersection(c["name"] for c in entry["conversations"])
+        )
 
     def get_character_profile(self, character: str) -> str:
-        return CHARACTERS[character]["profile"]
+        return _PROFILES[character]
+
+    def prompt_partials(self) -> dict[str, str]:
+        parser = PydanticOutputParser(pydantic_object=self.config.schema)
+        return {"format_instructions": parser.get_format_instructions()}
 
     def process_response(
         self,
@@ -110,6 +117,10 @@ class SatisfactionEvaluator(BaseEvaluator[ConversationSatisfactionEvaluation]):
         entry: dict[str, Any],
         character: str,
     ) -> tuple[int, list[dict[str, Any]]]:
+        # The schema only asks for corrections at score 3 or below
+        if response.score >= 4:
+            return 0, []
+
         corrections = []
         for c in response.corrections:
             if c.index is None:
@@ -128,45 +139,50 @@ class SatisfactionEvaluator(BaseEvaluator[ConversationSatisfactionEvaluation]):
     def save_corrections(
         self, corrections: list[dict[str, Any]], entry: dict[str, Any], session_id: str
     ) -> None:
-        msgs: list[dict[str, Any]] = []
-        for i, m in enumerate(entry["conversations"]):
-            for correction in corrections:
-                if correction["index"] == i:
-                    next_speaker = extract_next_speaker(m["utterance"])
-                    chosen = (
-                        CHARACTERS[m["name"]]["tag"]
-                        + f"[emotion:{correction['emotion']}]"
-                        + correction["chosen"]
-                        + f"[next:{next_speaker}]"
-                    )
-                    data = {
-                        "scene": entry["scenario"],
-                        "messages": msgs,
-                        "reason": correction["reason"],
-                        "chosen": chosen,
-                        "rejected": m["utterance"],
-                        "score": correction["score"],
-                        "speaker": m["name"],
-                    }
-                    sample_path = (
-                        self.output_dir / f"{session_id}={correction['index']:02d}.json"
-                    )
-                    with open(sample_path, "w") as f_json:
-                        json.dump(
-                            data,
-                            f_json,
-                            indent=2,
-                            ensure_ascii=False,
-                            cls=self.DateTimeEncoder,
-                        )
-            msgs.append(m)
-
-    @property
-    def DateTimeEncoder(self) -> type:
-        """Access to DateTimeEncoder for compatibility."""
-        from spalign.evaluation.base import DateTimeEncoder
-
-        return DateTimeEncoder
+        if not corrections:
+            return
+
+        # An immutable view: prefixes below are slices that are only serialized
+        conversations = tuple(entry["conversations"])
+        n_conversations = len(conversations)
+
+        # Bucket corrections by target message so each message is one lookup
+        by_index: dict[int, list[dict[str, Any]]] = {}
+        for correction in corrections:
+            if 0 <= correction["index"] < n_conversations:
+                by_index.setdefault(correction["index"], []).append(correction)
+
+        scene = entry["scenario"]
+
+        # Visit only the corrected messages, in conversation order
+        for i in sorted(by_index):
+            m = conversations[i]
+            msgs = conversations[:i]
+            # Per-message values are shared by every correction of the message
+            speaker = m["name"]
+            rejected = m["utterance"]
+            tag = _TAGS[speaker]
+            next_tag = f"[next:{extract_next_speaker(rejected)}]"
+            for correction in by_index[i]:
+                chosen = (
+                    tag
+                    + f"[emotion:{correction['emotion']}]"
+                    + correction["chosen"]
+                    + next_tag
+                )
+                data = {
+                    "scene": scene,
+                    "messages": msgs,
+                    "reason": correction["reason"],
+                    "chosen": chosen,
+                    "rejected": rejected,
+                    "score": correction["score"],
+                    "speaker": speaker,
+                }
+                sample_path = (
+                    self.output_dir / f"{session_id}={correction['index']:02d}.json"
+                )
+                self.write_json(sample_path, data)
 
 
 def main() -> None:
@@ -201,7 +217,17 @@ def main() -> None:
             data_files=str(log_dir / "conversations.bak.jsonl"),
             split=f"train[:{args.max}]",
         )
-    dataset = dataset.filter(lambda x: len(x["conversations"]) >= 5)
+    # Length check runs as an Arrow kernel over whole batches
+    dataset = (
+        dataset.with_format("arrow")
+        .filter(
+            lambda t: pc.greater_equal(
+                pc.list_value_length(t["conversations"]), 5
+            ).to_pylist(),
+            batched=True,
+        )
+        .with_format(None)
+    )
 
     # Run evaluation
     evaluator.run_evaluation(
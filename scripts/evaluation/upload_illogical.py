@@ -1,11 +1,11 @@
 if __name__ == "__main__":
     import argparse
     import glob
-    import json
     import os
     import re
     from pathlib import Path
 
+    import orjson
     from datasets import Dataset
     from loguru import logger
 
@@ -16,9 +16,13 @@ if __name__ == "__main__":
     parser.add_argument("--use_first", action="store_true")
     args = parser.parse_args()
 
+    _DUP_RE = re.compile(r"^\[([^\]]+)\]\[\1\]")
+
     def remove_duplicate(text):
-        result = re.sub(r"^\[([^\]]+)\]\[\1\]", r"[\1]", text)
-        return result
+        # 先頭に [X][X] がありえない発話は正規表現を通さない
+        if not text.startswith("[") or text.count("[") < 2:
+            return text
+        return _DUP_RE.sub(r"[\1]", text)
 
     RUN_NAME = args.run_name
 
@@ -29,45 +33,48 @@ if __name__ == "__main__":
     jsons = glob.glob(str(data_dir / "*.json"))
     print("jsons:", len(jsons))
 
-    jsons_first = []  # 最初のindexのみのデータセット
-    prev = None
-    for j in sorted(jsons):
-        stem = str(Path(j).stem).split("=")[0]
-        if prev == stem:
-            continue
-        prev = stem
-        jsons_first.append(j)
-
-    def prepare_dataset(jsons):
-        data_list = []
-        prev = None
+    def first_per_session(jsons):
+        """セッションごとに最初の index のファイルだけを残す"""
+        # ソートせず 1 パスで、セッションごとに辞書順最小のパスを残す
+        first_by_stem = {}
         for j in jsons:
-            if args.use_first:
-                stem = str(Path(j).stem).split("=")[0]
-                if prev == stem:
-                    continue
-                prev = stem
-            with open(j, "r") as f:
-                data_list.append(json.load(f))
-
-        ds = Dataset.from_list(data_list)
-
-        recs = []
-        for d in ds:
-            asst = d["speaker"]
+            stem = Path(j).stem.split("=", 1)[0]
+            if stem not in first_by_stem or j < first_by_stem[stem]:
+                first_by_stem[stem] = j
+        return list(first_by_stem.values())
+
+    jsons_first = first_per_session(jsons)  # 最初のindexのみのデータセット
+
+    def to_preference(batch):
+        """列形式のバッチを preference 形式のレコードに変換する"""
+        out = {
+            "assistant": [],
+            "scene": [],
+            "messages": [],
+            "chosen": [],
+            "rejected": [],
+            "metadata": [],
+        }
+        for asst, scene, messages, chosen, rejected, score, reason, issue_type in zip(
+            batch["speaker"],
+            batch["scene"],
+            batch["messages"],
+            batch["chosen"],
+            batch["rejected"],
+            batch["score"],
+            batch["reason"],
+            batch["issue_type"],
+        ):
             msgs = [
                 {"role": "assistant_name", "content": asst},
-                {"role": "system", "content": d["scene"]},
+                {"role": "system", "content": scene},
             ]
 
-            speakers = set()
-            for m in d["messages"]:
-                speakers.add(m["name"])
-
-            role_mapping = {s: i for i, s in enumerate(speakers)}
+            # 話者番号は出現順に 1 パスで割り当てる
+            role_mapping = {}
 
             prev = None
-            for m in d["messages"]:
+            for m in messages:
                 if prev == m["utterance"]:
                     continue
 
@@ -78,8 +85,11 @@ if __name__ == "__main__":
                     content = remove_duplicate(m["utterance"]) + "[next:user_00]"
 
                 if m["name"] != asst:
-                    role = f"user_{role_mapping[m['name']]:02d}"
-                    _, _, content, _ = parse_utterance(content)
+                    role_id = role_mapping.setdefault(m["name"], len(role_mapping))
+                    role = f"user_{role_id:02d}"
+                    # タグが無ければ parse しても内容は変わらない
+                    if "[" in content:
+                        _, _, content, _ = parse_utterance(content)
                 else:
                     role = "assistant"
                 msgs.append(
@@ -88,30 +98,59 @@ if __name__ == "__main__":
                         "content": content,
                     }
                 )
-            recs.append(
-                {
-                    "assistant": asst,
-                    "scene": d["scene"],
-                    "messages": msgs,
-                    "chosen": d["chosen"],
-                    "rejected": remove_duplicate(d["rejected"]),
-                    "metadata": {
-                        "score": d["score"],
-                        "reason": d["reason"],
-                        "issue_type": d["issue_type"],
-                    },
-                }
-            )
 
-        print(recs[0])
+            out["assistant"].append(asst)
+            out["scene"].append(scene)
+            out["messages"].append(msgs)
+            out["chosen"].append(chosen)
+            out["rejected"].append(remove_duplicate(rejected))
+            out["metadata"].append(
+                {"score": score, "reason": reason, "issue_type": issue_type}
+            )
+        return out
+
+    def to_formatted(batch):
+        """chosen / rejected を assistant メッセージに包む"""
+        return {
+            "chosen": [{"role": "assistant", "content": c} for c in batch["chosen"]],
+            "rejected": [
+                {"role": "assistant", "content": r} for r in batch["rejected"]
+            ],
+        }
 
-        new_ds = Dataset.from_list(recs)
+    def prepare_dataset(jsons):
+        if args.use_first:
+            jsons = first_per_session(jsons)
+
+        num_proc = min(16, os.cpu_count() or 1)
+
+        # 型は全レコードを見て決める必要がある (messages が空や null だけのファイルがあり、
+        # ファイルごとにスキーマを推論する load_dataset("json") だと cast に失敗する)
+        # ので、パースだけ orjson で速くして Dataset.from_list に渡す
+        ds = Dataset.from_list([orjson.loads(Path(j).read_bytes()) for j in jsons])
+
+        # 大きな会話が 1 ワーカーに偏らないよう、シャッフルしてから並列変換する
+        ds = ds.shuffle(seed=0)
+        new_ds = ds.map(
+            to_preference,
+            batched=True,
+            batch_size=256,
+            num_proc=num_proc,
+            remove_columns=ds.column_names,
+        )
+
+        print(new_ds[0])
         print(new_ds)
 
-        return new_ds
+        # chosen / rejected をメッセージ形式で包んだ版も push 前にバッチ変換で作っておく
+        new_ds_formatted = new_ds.map(
+            to_formatted, batched=True, batch_size=1000, num_proc=num_proc
+        )
+
+        return new_ds, new_ds_formatted
 
-    new_ds = prepare_dataset(jsons)
-    new_ds_first = prepare_dataset(jsons_first)
+    new_ds, new_ds_formatted = prepare_dataset(jsons)
+    new_ds_first, new_ds_first_formatted = prepare_dataset(jsons_first)
 
     new_ds.push_to_hub(
         "Spiral-AI/HappyRat-Preference",
@@ -127,24 +166,12 @@ if __name__ == "__main__":
     )
     logger.success("Finished uploading to hub")
 
-    new_ds_formatted = new_ds.map(
-        lambda x: {
-            "chosen": {"role": "assistant", "content": x["chosen"]},
-            "rejected": {"role": "assistant", "content": x["rejected"]},
-        }
-    )
     new_ds_formatted.push_to_hub(
         "Spiral-AI/HappyRat-Preference-formatted",
         f"illogical-{RUN_NAME}",
         private=True,
     )
 
-    new_ds_first_formatted = new_ds_first.map(
-        lambda x: {
-            "chosen": {"role": "assistant", "content": x["chosen"]},
-            "rejected": {"role": "assistant", "content": x["rejected"]},
-        }
-    )
     new_ds_first_formatted.push_to_hub(
         "Spiral-AI/HappyRat-Preference-formatted",
         f"illogical-{RUN_NAME}-first",
@@ -1,14 +1,22 @@
 import glob
-import json
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import orjson
 
 files = glob.glob("scenarios_soyogisoyogi/scenario_*.json")
 
-concat = []
-for file in files:
-    with open(file, "r", encoding="utf-8") as f:
-        data = json.load(f)
-        data["scene"] = data.pop("scenario")
-        concat.append(data)
 
-with open("scenarios_soyogisoyogi/all.json", "w", encoding="utf-8") as f:
-    json.dump(concat, f, ensure_ascii=False, indent=2)
+def load_scene(file):
+    data = orjson.loads(Path(file).read_bytes())
+    data["scene"] = data.pop("scenario")
+    return data
+
+
+# 小さなファイルの読み込みは I/O 待ちが支配的なのでスレッドで重ねる
+with ThreadPoolExecutor(max_workers=32) as ex:
+    concat = list(ex.map(load_scene, files))
+
+Path("scenarios_soyogisoyogi/all.json").write_bytes(
+    orjson.dumps(concat, option=orjson.OPT_INDENT_2)
+)
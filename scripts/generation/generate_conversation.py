@@ -10,25 +10,33 @@ from __future__ import annotations
 
 import argparse
 import asyncio
-import json
 import os
+import time
 from datetime import datetime
 from pathlib import Path
 
+import orjson
 from datasets import load_dataset
 
 from spalign.conversation import ConversationGenerator
 from spalign.database import (
+    dump_completed_to_parquet,
     get_completed_results,
-    get_failed_scenarios,
-    get_pending_scenarios,
     get_progress_stats,
+    get_scenario_hashes,
+    get_scenarios_with_status,
     init_db,
     insert_pending_scenarios,
     reset_failed_to_pending,
 )
 from spalign.projects.happyrat.profiles import CHARACTERS
 
+# シナリオのフィルタリング用に一度だけ作っておく
+_CHARACTER_NAMES = frozenset(CHARACTERS)
+
+# 進行状況の DB 集計はこの秒数以内なら前回の結果を使い回す
+PROGRESS_STATS_TTL = 5.0
+
 
 def parse_arguments() -> argparse.Namespace:
     """Parse command line arguments."""
@@ -67,6 +75,12 @@ def parse_arguments() -> argparse.Namespace:
         default=20,
         help="Simultaneous GPT‑4 requests allowed",
     )
+    parser.add_argument(
+        "--vllm_concurrency",
+        type=int,
+        default=2048,
+        help="Max vLLM requests outstanding at the batcher",
+    )
     parser.add_argument(
         "--turns",
         type=int,
@@ -79,6 +93,11 @@ def parse_arguments() -> argparse.Namespace:
         action="store_true",
         help="Retry only failed scenarios from previous runs",
     )
+    parser.add_argument(
+        "--parquet",
+        action="store_true",
+        help="Also export completed conversations to a single Parquet file",
+    )
     parser.add_argument(
         "--scenario",
         type=str,
@@ -113,14 +132,17 @@ def create_backup_summary(backup_dir: Path, db_file: str) -> None:
     if all_results:
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         backup_file = backup_dir / f"backup_{timestamp}.json"
-        with backup_file.open("w", encoding="utf-8") as f:
-            json.dump(all_results, f, ensure_ascii=False, indent=2)
+        backup_file.write_bytes(
+            orjson.dumps(
+                all_results, option=orjson.OPT_INDENT_2 | orjson.OPT_APPEND_NEWLINE
+            )
+        )
         print(f"バックアップ作成: {backup_file} ({len(all_results)} 件)")
 
 
 def count_saved_conversations(conversations_dir: Path) -> int:
     """Count the number of saved conversation files."""
-    return len(list(conversations_dir.glob("*.json")))
+    return sum(1 for _ in conversations_dir.glob("*.json"))
 
 
 async def main():
@@ -137,16 +159,21 @@ async def main():
 
     # Load dataset
     dataset = load_dataset(args.scenario, args.scenario_subset, split="train").filter(
-        lambda x: set(CHARACTERS.keys()) & set(x["character_list"])
-        == set(x["character_list"])
+        lambda batch: [
+            _CHARACTER_NAMES.issuperset(chars) for chars in batch["character_list"]
+        ],
+        batched=True,
     )  # 使われていないキャラクターがあるので、ここでフィルタリング
 
+    # シナリオのハッシュ (JSON 直列化 + MD5) は一度だけ計算して使い回す
+    hashes = get_scenario_hashes(dataset)
+
     if args.retry_failed:
         # Retry failed scenarios mode
         print("失敗したシナリオの再試行モードです。")
 
         # Get failed scenarios before resetting
-        failed_scenarios = get_failed_scenarios(dataset, db_file)
+        failed_scenarios = get_scenarios_with_status(dataset, "failed", db_file, hashes)
         print(f"失敗したシナリオ: {len(failed_scenarios)} 件")
 
         if len(failed_scenarios) == 0:
@@ -161,10 +188,12 @@ async def main():
         target_scenarios = failed_scenarios
     else:
         # Normal mode: insert all scenarios as pending (if not already exists)
-        insert_pending_scenarios(dataset, db_file)
+        insert_pending_scenarios(dataset, db_file, hashes)
 
         # Get only pending scenarios
-        target_scenarios = get_pending_scenarios(dataset, db_file)
+        target_scenarios = get_scenarios_with_status(
+            dataset, "pending", db_file, hashes
+        )
 
     # Get progress statistics
     stats = get_progress_stats(db_file)
@@ -189,49 +218,96 @@ async def main():
     generator.start_batcher()
 
     gpt_sem = asyncio.Semaphore(args.gpt_concurrency)
-    semaphore = asyncio.Semaphore(args.max_concurrency)
+    vllm_sem = asyncio.Semaphore(args.vllm_concurrency)
+    # DB・ファイル I/O はすべてこのループの executor に逃がし、イベントループを止めない
+    loop = asyncio.get_running_loop()
 
-    async def limited_task(d):
-        async with semaphore:
-            return await generator.generate_conversation(
-                d, gpt_sem, args.turns, args.persona_type, db_file, conversations_dir
-            )
-
-    print(f"会話生成を開始: {len(target_scenarios)} 件")
-    tasks = [limited_task(d) for d in target_scenarios]
+    # シナリオはキューに積み、max_concurrency 個のワーカーが順に取り出す
+    # (全シナリオ分のタスクを最初に作らないのでメモリが件数に比例しない)
+    queue: asyncio.Queue = asyncio.Queue()
+    for d in target_scenarios:
+        queue.put_nowait(d)
 
     completed_count = 0
-    for coro in asyncio.as_completed(tasks):
-        try:
-            await coro
-            completed_count += 1
-
-            # Progress update every 10 completions
-            if completed_count % 10 == 0:
-                current_stats = get_progress_stats(db_file)
-                saved_count = count_saved_conversations(conversations_dir)
-                print(
-                    f"[進行状況] 完了: {current_stats.get('completed', 0)} 件, "
-                    f"失敗: {current_stats.get('failed', 0)} 件, "
-                    f"残り: {current_stats.get('pending', 0)} 件, "
-                    f"保存済み: {saved_count} 件"
-                )
+    # 結果を返した生成だけがファイルを 1 つ保存する (ペルソナ失敗時は {} で保存なし)。
+    # その件数を数えるので、ディレクトリの走査は開始時の 1 回だけでよい
+    new_saved_count = 0
+    initial_saved_count = await loop.run_in_executor(
+        None, count_saved_conversations, conversations_dir
+    )
+    stats_cache: tuple[float, dict] | None = None
+
+    async def cached_progress_stats() -> dict:
+        nonlocal stats_cache
+        now = time.monotonic()
+        if stats_cache is None or now - stats_cache[0] >= PROGRESS_STATS_TTL:
+            stats = await loop.run_in_executor(None, get_progress_stats, db_file)
+            stats_cache = (now, stats)
+        return stats_cache[1]
+
+    async def report_progress() -> None:
+        # await 中に他のワーカーが進めても、この回の件数で判定する
+        done = completed_count
+        saved_count = initial_saved_count + new_saved_count
+
+        # Progress update every 10 completions
+        if done % 10 == 0:
+            current_stats = await cached_progress_stats()
+            print(
+                f"[進行状況] 完了: {current_stats.get('completed', 0)} 件, "
+                f"失敗: {current_stats.get('failed', 0)} 件, "
+                f"残り: {current_stats.get('pending', 0)} 件, "
+                f"保存済み: {saved_count} 件"
+            )
 
-                # Backup every 50 completions
-                if completed_count % 50 == 0:
-                    create_backup_summary(backup_dir, db_file)
-                    print("バックアップ作成完了")
+            # Backup every 50 completions
+            # (大きな JSON の書き出しでイベントループを止めないようスレッドで行う)
+            if done % 50 == 0:
+                await loop.run_in_executor(
+                    None, create_backup_summary, backup_dir, db_file
+                )
+                print("バックアップ作成完了")
+
+    async def worker() -> None:
+        nonlocal completed_count, new_saved_count
+        while not queue.empty():
+            # ハッシュは計算済みのものを渡し、シナリオを再度直列化しない
+            scenario_hash, d = queue.get_nowait()
+            try:
+                result = await generator.generate_conversation(
+                    d,
+                    gpt_sem,
+                    args.turns,
+                    args.persona_type,
+                    db_file,
+                    conversations_dir,
+                    scenario_hash=scenario_hash,
+                    vllm_semaphore=vllm_sem,
+                )
+                if result:
+                    new_saved_count += 1
+                completed_count += 1
+                await report_progress()
+            except Exception as e:
+                print(f"エラー: {e}")
 
-        except Exception as e:
-            print(f"エラー: {e}")
-            continue
+    print(f"会話生成を開始: {len(target_scenarios)} 件")
+    n_workers = min(args.max_concurrency, len(target_scenarios))
+    await asyncio.gather(*(worker() for _ in range(n_workers)))
 
     # Final export
     print("最終結果を確認中...")
-    saved_count = count_saved_conversations(conversations_dir)
-    create_backup_summary(backup_dir, db_file)
-
-    final_stats = get_progress_stats(db_file)
+    saved_count = initial_saved_count + new_saved_count
+    await loop.run_in_executor(None, create_backup_summary, backup_dir, db_file)
+    if args.parquet:
+        # 会話ごとの JSON ファイルとは別に、完了分を 1 つの Parquet にまとめる
+        parquet_file = output_dir / "conversations.parquet"
+        n_rows = await loop.run_in_executor(
+            None, dump_completed_to_parquet, db_file, str(parquet_file)
+        )
+        print(f"Parquet 出力: {parquet_file} ({n_rows} 件)")
+
+    final_stats = await loop.run_in_executor(None, get_progress_stats, db_file)
     print(f"完了: {saved_count} 件の会話が {conversations_dir} に保存されました")
     print(f"最終統計: {final_stats}")
 
@@ -9,16 +9,21 @@ and OpenAI GPT models for persona characters.
 # from .batcher import VLLMBatcher
 # from .conversation import ConversationGenerator
 from .database import (
+    dump_completed_to_parquet,
     get_completed_results,
     get_failed_scenarios,
     get_pending_scenarios,
     get_progress_stats,
     get_scenario_hash,
+    get_scenario_hashes,
+    get_scenarios_with_status,
     init_db,
     insert_pending_scenarios,
     mark_completed,
+    mark_completed_many,
     mark_failed,
     reset_failed_to_pending,
+    submit_completed,
 )
 from .models import PersonaParams, PersonaResponse
 from .persona import PersonaGenerator
@@ -37,14 +42,19 @@ __all__ = [
     # Database functions
     "init_db",
     "get_scenario_hash",
+    "get_scenario_hashes",
+    "get_scenarios_with_status",
     "insert_pending_scenarios",
     "get_pending_scenarios",
     "mark_completed",
+    "mark_completed_many",
     "mark_failed",
     "get_completed_results",
+    "dump_completed_to_parquet",
     "get_progress_stats",
     "get_failed_scenarios",
     "reset_failed_to_pending",
+    "submit_completed",
     # Utilities
     "strip_tags",
     "parse_role",
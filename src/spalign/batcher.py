@@ -3,45 +3,74 @@
 from __future__ import annotations
 
 import asyncio
+import threading
 from dataclasses import dataclass
+from typing import Any
 
 from vllm import LLM, SamplingParams
+from vllm.inputs import TokensPrompt
 
 
 @dataclass
 class _Request:
     """Internal request structure for batching."""
 
-    prompt: str
+    prompt: str | list[int]
     future: asyncio.Future[str]
 
 
 class VLLMBatcher:
     """Collect prompts, run vLLM generate() in bulk, return result to futures."""
 
-    def __init__(self, llm: LLM, max_batch: int = 32, max_latency_ms: int = 25):
+    def __init__(
+        self,
+        llm: LLM,
+        max_batch: int = 32,
+        max_latency_ms: int = 25,
+        tokenizer: Any | None = None,
+        tokenizer_lock: threading.Lock | None = None,
+    ):
         self.llm = llm
+        # When given, each batch is tokenized in one call and sent as token ids.
+        self.tokenizer = tokenizer
+        # HF fast tokenizers are not re-entrant ("Already borrowed"); pass the
+        # lock guarding every other use of the same tokenizer object.
+        self.tokenizer_lock = tokenizer_lock or threading.Lock()
         self.queue: asyncio.Queue[_Request] = asyncio.Queue()
         self.max_batch = max_batch
         self.max_latency = max_latency_ms / 1000.0
+        # The values never change, so validate and build them only once.
+        self._sampling_params = SamplingParams(
+            temperature=0.15,
+            top_p=0.9,
+            top_k=32,
+            max_tokens=128,
+            skip_special_tokens=False,
+        )
 
-    async def put(self, prompt: str) -> asyncio.Future[str]:
-        """Submit a prompt for batched generation."""
-        fut: asyncio.Future[str] = asyncio.get_event_loop().create_future()
+    async def put(self, prompt: str | list[int]) -> asyncio.Future[str]:
+        """Submit a prompt (text or token ids) for batched generation."""
+        fut: asyncio.Future[str] = asyncio.get_running_loop().create_future()
         await self.queue.put(_Request(prompt, fut))
         return fut
 
     async def _runner(self):
         """Background task that actually calls vLLM."""
+        loop = asyncio.get_running_loop()
         while True:
             # Guarantee at least one item.
             req = await self.queue.get()
             prompts = [req.prompt]
             futures = [req.future]
-            start = asyncio.get_event_loop().time()
+            # Take whatever is already queued without arming a timer per item.
+            while len(prompts) < self.max_batch and not self.queue.empty():
+                req = self.queue.get_nowait()
+                prompts.append(req.prompt)
+                futures.append(req.future)
+            start = loop.time()
             # Collect until latency or max_batch reached.
             while len(prompts) < self.max_batch:
-                timeout = self.max_latency - (asyncio.get_event_loop().time() - start)
+                timeout = self.max_latency - (loop.time() - start)
                 if timeout <= 0:
                     break
                 try:
@@ -52,11 +81,11 @@ class VLLMBatcher:
                     break
 
             # Generate in bulk (blocking CPU thread; offload to default executor).
-            loop = asyncio.get_running_loop()
             try:
                 outs = await loop.run_in_executor(
                     None,
-                    lambda: self.llm.generate(prompts, self._get_sampling_params()),
+                    self._generate,
+                    prompts,
                 )
                 # Send results back.
                 for fut, out in zip(futures, outs):
@@ -69,15 +98,30 @@ class VLLMBatcher:
                     if not fut.cancelled():
                         fut.set_result("")
 
+    def _generate(self, prompts: list[str | list[int]]):
+        """Run one vLLM generate() call for a collected batch."""
+        inputs = list(prompts)
+        texts = [i for i, p in enumerate(inputs) if isinstance(p, str)]
+        if self.tokenizer is not None and texts:
+            # Prompts are rendered chat templates that already carry their
+            # special tokens, so none are added here.
+            with self.tokenizer_lock:
+                encoded = self.tokenizer(
+                    [inputs[i] for i in texts], add_special_tokens=False
+                )["input_ids"]
+            for i, ids in zip(texts, encoded):
+                inputs[i] = ids
+        return self.llm.generate(
+            [
+                p if isinstance(p, str) else TokensPrompt(prompt_token_ids=p)
+                for p in inputs
+            ],
+            self._sampling_params,
+        )
+
     def _get_sampling_params(self) -> SamplingParams:
         """Get default sampling parameters."""
-        return SamplingParams(
-            temperature=0.15,
-            top_p=0.9,
-            top_k=32,
-            max_tokens=128,
-            skip_special_tokens=False,
-        )
+        return self._sampling_params
 
     def start(self):
         """Start the background batching task."""
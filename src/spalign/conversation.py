@@ -3,12 +3,26 @@
 from __future__ import annotations
 
 import asyncio
+import contextlib
+import functools
+import json
+import os
 import random
+import threading
 import uuid
+from bisect import bisect
+from datetime import datetime
+from functools import cached_property
+from itertools import accumulate
 from pathlib import Path
-from typing import Any, Literal
+from typing import Any, ClassVar, Literal
 
+import numpy as np
+import orjson
 from datasets import load_dataset
+from jinja2 import TemplateError
+from jinja2.ext import Extension, loopcontrols
+from jinja2.sandbox import ImmutableSandboxedEnvironment
 from loguru import logger
 from transformers import AutoTokenizer
 from vllm import LLM
@@ -18,10 +32,160 @@ from spalign.projects.happyrat.profiles import CHARACTERS
 from spalign.utils import parse_utterance
 
 from .batcher import VLLMBatcher
-from .database import get_scenario_hash, mark_completed, mark_failed
+from .database import get_scenario_hash, mark_failed, submit_completed
 from .models import PersonaParams
 from .persona import PersonaGenerator
-from .utils import history_to_msgs, parse_role
+from .utils import history_entry_to_msgs, parse_role, relabel_history_msgs
+
+
+def _raise_exception(message: str):
+    raise TemplateError(message)
+
+
+def _tojson(x, ensure_ascii=False, indent=None, separators=None, sort_keys=False):
+    return json.dumps(
+        x,
+        ensure_ascii=ensure_ascii,
+        indent=indent,
+        separators=separators,
+        sort_keys=sort_keys,
+    )
+
+
+class _GenerationBlock(Extension):
+    """``{% generation %}`` blocks as in transformers, rendered as their body
+    (transformers only uses them to locate assistant tokens)."""
+
+    tags: ClassVar[set[str]] = {"generation"}
+
+    def parse(self, parser):
+        next(parser.stream)
+        return parser.parse_statements(("name:endgeneration",), drop_needle=True)
+
+
+def _compile_chat_template(template: str):
+    """Compile a tokenizer chat template with the same environment as transformers."""
+    env = ImmutableSandboxedEnvironment(
+        trim_blocks=True,
+        lstrip_blocks=True,
+        extensions=[loopcontrols, _GenerationBlock],
+    )
+    env.filters["tojson"] = _tojson
+    env.globals["raise_exception"] = _raise_exception
+    env.globals["strftime_now"] = lambda fmt: datetime.now().strftime(fmt)
+    return env.from_string(template)
+
+
+class _ChatPromptBuilder:
+    """Build chat prompts from LRU-cached per-message template fragments.
+
+    Each history message is rendered through the chat template once per
+    (role, content) pair and each head once per (speaker, scenario); prompts
+    are the cached pieces joined with the generation-prompt suffix. The caches
+    are shared by every conversation of a generator, so scenarios and opening
+    lines that recur across conversations are rendered only once. This is only
+    valid for templates that render every message independently of its
+    neighbours, which ``is_exact`` checks against a full render.
+
+    With ``enable_token_ids`` the same pieces are also cached as token ids, so
+    a prompt's ids are assembled without tokenizing the whole history again.
+    """
+
+    _PROBE_MSGS = (
+        {"role": "user_00", "content": "a"},
+        {"role": "assistant", "content": "b"},
+        {"role": "user_01", "content": "c"},
+    )
+
+    def __init__(self, render, maxsize: int = 4096):
+        self._render = render
+        self._maxsize = maxsize
+        self._encode = None
+        # Fragments are cut out of renders that follow a fixed anchor head
+        self._anchor = self._lead("", "")
+        self._anchor_text = render(self._anchor, False)
+        self._suffix = render(self._anchor, True)[len(self._anchor_text) :]
+        self._head = functools.lru_cache(maxsize=maxsize)(self._render_head)
+        self._fragment = functools.lru_cache(maxsize=maxsize)(self._render_fragment)
+
+    @staticmethod
+    def _lead(speaker: str, scenario: str) -> list[dict[str, str]]:
+        return [
+            {"role": "assistant_name", "content": speaker},
+            {"role": "system", "content": scenario},
+        ]
+
+    def _render_head(self, speaker: str, scenario: str) -> str:
+        return self._render(self._lead(speaker, scenario), False)
+
+    def _render_fragment(self, role: str, content: str) -> str:
+        msg = {"role": role, "content": content}
+        return self._render([*self._anchor, msg], False)[len(self._anchor_text) :]
+
+    def build(self, msgs: list[dict[str, str]], speaker: str, scenario: str) -> str:
+        fragment = self._fragment
+        return (
+            self._head(speaker, scenario)
+            + "".join([fragment(m["role"], m["content"]) for m in msgs])
+            + self._suffix
+        )
+
+    def enable_token_ids(self, encode, special_tokens: tuple[str, ...]) -> bool:
+        """Cache token ids for the pieces; returns whether this is exact."""
+        self._encode = encode
+        self._special_tokens = special_tokens
+        self._head_ids = functools.lru_cache(maxsize=self._maxsize)(
+            lambda speaker, scenario: self._piece_ids(self._head(speaker, scenario))
+        )
+        self._fragment_ids = functools.lru_cache(maxsize=self._maxsize)(
+            lambda role, content: self._piece_ids(self._fragment(role, content))
+        )
+        self._tail_ids = functools.lru_cache(maxsize=64)(
+            lambda tail: tuple(encode(self._suffix + tail))
+        )
+        msgs = self._PROBE_MSGS
+        if self.build_ids(msgs, "x", "scene") != encode(self.build(msgs, "x", "scene")):
+            self._encode = None
+        return self._encode is not None
+
+    def _piece_ids(self, text: str) -> tuple[int, ...] | None:
+        # The tokenizer splits on special tokens before anything else, so a
+        # piece ending in one tokenizes the same on its own as inside a prompt.
+        if not text.endswith(self._special_tokens):
+            return None
+        return tuple(self._encode(text))
+
+    def build_ids(
+        self, msgs: list[dict[str, str]], speaker: str, scenario: str, tail: str = ""
+    ) -> list[int] | None:
+        """Token ids of ``build(...) + tail``, or None if they cannot be assembled."""
+        if self._encode is None:
+            return None
+        head = self._head_ids(speaker, scenario)
+        if head is None:
+            return None
+        ids = list(head)
+        for m in msgs:
+            fragment = self._fragment_ids(m["role"], m["content"])
+            if fragment is None:
+                return None
+            ids += fragment
+        ids += self._tail_ids(tail)
+        return ids
+
+    @classmethod
+    def is_exact(cls, render) -> bool:
+        """Whether fragment joining reproduces full renders for this template."""
+        msgs = cls._PROBE_MSGS
+        try:
+            builder = cls(render, maxsize=8)
+            if not render(builder._anchor, True).startswith(builder._anchor_text):
+                return False
+            expected = render([*cls._lead("x", "scene"), *msgs], True)
+            return builder.build(msgs, "x", "scene") == expected
+        # A template that cannot render the probe is not separable either
+        except (TemplateError, TypeError, ValueError, LookupError):
+            return False
 
 
 class ConversationGenerator:
@@ -36,6 +200,7 @@ class ConversationGenerator:
         max_num_batched_tokens: int = 8192,
         max_model_len: int = 8192,
         gpu_memory_utilization: float = 0.95,
+        enable_prefix_caching: bool = True,
     ):
         self.model_name = model_name
         self.llm = LLM(
@@ -45,15 +210,84 @@ class ConversationGenerator:
             max_num_batched_tokens=max_num_batched_tokens,
             max_model_len=max_model_len,
             gpu_memory_utilization=gpu_memory_utilization,
+            # Consecutive turns of a conversation share the speaker/scenario head
+            # and most of the history, so their KV blocks can be reused.
+            enable_prefix_caching=enable_prefix_caching,
         )
-        self.batcher = VLLMBatcher(self.llm)
         self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-        self.persona_generator = PersonaGenerator(language)
-        self.persona_ds = load_dataset(
-            "Spiral-AI/Synthesized-Persona-20250103", split="train"
+        # Prompt pieces are encoded in worker threads while the batcher encodes
+        # in the executor; the fast tokenizer must only be used by one at a time.
+        self._tokenizer_lock = threading.Lock()
+        self.batcher = VLLMBatcher(
+            self.llm, tokenizer=self.tokenizer, tokenizer_lock=self._tokenizer_lock
         )
-        self.app_persona_ds = load_dataset(
-            "Spiral-AI/Synthesized-AppPersona-20250818", split="train"
+        # Compile the chat template once and render it directly on every turn,
+        # skipping apply_chat_template's per-call template resolution.
+        self._chat_tmpl_vars = dict(self.tokenizer.special_tokens_map)
+        self._chat_tmpl = self._load_chat_template()
+        self._prompt_builder = (
+            _ChatPromptBuilder(self._render_chat)
+            if _ChatPromptBuilder.is_exact(self._render_chat)
+            else None
+        )
+        if self._prompt_builder is None:
+            logger.warning(
+                "Chat template is not message-separable; rendering full history per turn"
+            )
+        elif not self._prompt_builder.enable_token_ids(
+            self._encode,
+            tuple(self.tokenizer.added_tokens_encoder),
+        ):
+            logger.warning("Cached token ids do not match; vLLM prompts sent as text")
+        self.persona_generator = PersonaGenerator(language)
+
+    # Persona datasets are only needed by their persona types: load each on first
+    # use and keep it for every later conversation.
+    @cached_property
+    def persona_ds(self):
+        return load_dataset("Spiral-AI/Synthesized-Persona-20250103", split="train")
+
+    @cached_property
+    def app_persona_ds(self):
+        return load_dataset("Spiral-AI/Synthesized-AppPersona-20250818", split="train")
+
+    def _encode(self, text: str) -> list[int]:
+        with self._tokenizer_lock:
+            return self.tokenizer.encode(text, add_special_tokens=False)
+
+    def _load_chat_template(self):
+        """Compiled chat template, or None to render with apply_chat_template."""
+        probe = [
+            *_ChatPromptBuilder._lead("x", "scene"),
+            *_ChatPromptBuilder._PROBE_MSGS,
+        ]
+        try:
+            tmpl = _compile_chat_template(self.tokenizer.chat_template)
+            rendered = tmpl.render(
+                messages=probe, add_generation_prompt=True, **self._chat_tmpl_vars
+            )
+            expected = self.tokenizer.apply_chat_template(
+                probe, tokenize=False, add_generation_prompt=True
+            )
+        except (TemplateError, TypeError, ValueError) as e:
+            logger.warning(f"Chat template could not be compiled directly: {e}")
+            return None
+        if rendered != expected:
+            logger.warning("Compiled chat template differs; using apply_chat_template")
+            return None
+        return tmpl
+
+    def _render_chat(
+        self, messages: list[dict[str, str]], add_generation_prompt: bool = True
+    ) -> str:
+        if self._chat_tmpl is None:
+            return self.tokenizer.apply_chat_template(
+                messages, tokenize=False, add_generation_prompt=add_generation_prompt
+            )
+        return self._chat_tmpl.render(
+            messages=messages,
+            add_generation_prompt=add_generation_prompt,
+            **self._chat_tmpl_vars,
         )
 
     def start_batcher(self):
@@ -68,9 +302,12 @@ class ConversationGenerator:
         persona_type: str,
         db_file: str,
         conversations_dir: Path,
+        scenario_hash: str | None = None,
+        vllm_semaphore: asyncio.Semaphore | None = None,
     ) -> dict[str, Any]:
         """Generate a single conversation asynchronously."""
-        scenario_hash = get_scenario_hash(data)
+        if scenario_hash is None:
+            scenario_hash = get_scenario_hash(data)
 
         try:
             # Validate input data structure
@@ -96,7 +333,9 @@ class ConversationGenerator:
                 raise ValueError("character_list cannot be empty")
 
             logger.debug(
-                f"Starting conversation generation with {len(characters)} characters: {characters}"
+                "Starting conversation generation with {} characters: {}",
+                len(characters),
+                characters,
             )
 
             # Persona selection
@@ -107,7 +346,7 @@ class ConversationGenerator:
                 p_name = random.choice(list(NORMAL_PERSONAS.keys()))
                 info = NORMAL_PERSONAS[p_name]
             elif persona_type == "persona":  # dataset mode (randomized)
-                ds_row = random.choice(self.persona_ds)
+                ds_row = self.persona_ds[random.randrange(len(self.persona_ds))]
                 p_name = ds_row["new_persona_name"]
                 base = max(
                     0.01, random.gauss(mu=0.5, sigma=0.2)
@@ -120,7 +359,7 @@ class ConversationGenerator:
                     "recovery_step": random.uniform(0.05, 0.3),
                 }
             elif persona_type == "app_persona":
-                ds_row = random.choice(self.app_persona_ds)
+                ds_row = self.app_persona_ds[random.randrange(len(self.app_persona_ds))]
                 p_name = ds_row["name"]
                 profile = f"""{ds_row["profile"]}\n\n### Purpose\n{ds_row["purpose"]}\n\n### Attitude\n{ds_row["attitude"]}"""
                 base = max(
@@ -157,26 +396,41 @@ class ConversationGenerator:
             if not roles:
                 raise ValueError("Failed to parse roles from characters")
 
-            logger.debug(f"Parsed roles: {roles}")
-            logger.debug(f"Index mapping: {idx_map}")
+            logger.debug("Parsed roles: {}", roles)
+            logger.debug("Index mapping: {}", idx_map)
+
+            # Speakers other than the persona; fixed for the whole conversation
+            others = tuple(n for n in roles.values() if n != p_name)
+
+            # Speaker selection makes one weighted draw per turn; draw all the
+            # uniforms up front from a per-conversation generator instead of
+            # calling into `random` turn by turn.
+            rng = np.random.default_rng()
+            draws = rng.random(n_turns).tolist()
 
             histories: list[dict[str, Any]] = []
+            # Each entry converted once, as it is appended to histories
+            hist_entries: list[tuple[str, dict[str, str], dict[str, str]]] = []
+
+            # Template fragments are cached across turns and conversations
+            prompt_builder = self._prompt_builder
 
             def format_hist(msgs, speaker, scenario):
-                new_msgs = msgs.copy()
-                new_msgs.insert(0, {"role": "assistant_name", "content": speaker})
-                new_msgs.insert(1, {"role": "system", "content": scenario})
-                if not new_msgs:
-                    return "<s><|start_header_id|>assistant<|end_header_id|>\n\n"
-                prompt = self.tokenizer.apply_chat_template(
-                    new_msgs, tokenize=False, add_generation_prompt=True
-                )
+                if prompt_builder is not None:
+                    prompt = prompt_builder.build(msgs, speaker, scenario)
+                else:
+                    new_msgs = [
+                        {"role": "assistant_name", "content": speaker},
+                        {"role": "system", "content": scenario},
+                        *msgs,
+                    ]
+                    prompt = self._render_chat(new_msgs)
                 prompt += CHARACTERS.get("speaker", {}).get("tag", "")
                 return prompt
 
             for t in range(n_turns):
                 try:
-                    logger.debug(f"Turn {t}/{n_turns}: Starting speaker selection")
+                    logger.debug("Turn {}/{}: Starting speaker selection", t, n_turns)
 
                     # Speaker selection with bounds checking
                     if t == 0:
@@ -186,79 +440,80 @@ class ConversationGenerator:
                                 f"Role index 0 not found in roles: {roles}"
                             )
                         speaker = roles[0]
-                        logger.debug(f"Turn {t}: Initial speaker selected: {speaker}")
+                        logger.debug(
+                            "Turn {}: Initial speaker selected: {}", t, speaker
+                        )
                     else:
-                        others = [n for n in roles.values() if n != p_name]
-                        logger.debug(f"Turn {t}: Available other speakers: {others}")
-
-                        if random.random() < p_prob / (
-                            len(characters) + 1
-                        ):  # キャラクター数に応じて確率を調整。
-                            speaker = p_name
-                            logger.debug(
-                                f"Turn {t}: Persona speaker selected: {speaker}"
-                            )
+                        logger.debug("Turn {}: Available other speakers: {}", t, others)
+
+                        # One weighted draw over [persona, repeat last, *others];
+                        # the persona weight scales with the number of characters.
+                        persona_w = p_prob / (len(characters) + 1)
+                        last_history = histories[-1] if histories else None
+                        last_name = last_history.get("name") if last_history else None
+                        population = (p_name, last_name, *others)
+                        if others:
+                            # 10% of the rest repeats the last speaker, 90% goes
+                            # to the others (all of it without a last speaker)
+                            rest = max(0.0, 1.0 - persona_w)
+                            repeat_w = rest * 0.1 if last_name is not None else 0.0
+                            other_w = (rest - repeat_w) / len(others)
+                            weights = (persona_w, repeat_w, *([other_w] * len(others)))
                         else:
-                            # Safe access to histories
-                            if len(histories) > 0:
-                                last_history = histories[-1]
-                                if (
-                                    isinstance(last_history, dict)
-                                    and "next_speaker" in last_history
-                                    and last_history["next_speaker"] == "myself"
-                                ):
-                                    if "name" in last_history:
-                                        speaker = last_history["name"]
-                                        logger.debug(
-                                            f"Turn {t}: 'myself' speaker selected: {speaker}"
-                                        )
-                                    else:
-                                        logger.warning(
-                                            f"Turn {t}: Last history missing 'name' field"
-                                        )
-                                        speaker = (
-                                            random.choice(others) if others else p_name
-                                        )
-                                else:
-                                    if others:
-                                        if random.random() < 0.9:
-                                            speaker = random.choice(others)
-                                        else:
-                                            if "name" in last_history:
-                                                speaker = last_history["name"]
-                                            else:
-                                                speaker = random.choice(others)
-                                        logger.debug(
-                                            f"Turn {t}: Random/repeat speaker selected: {speaker}"
-                                        )
-                                    else:
-                                        speaker = p_name
-                                        logger.warning(
-                                            f"Turn {t}: No other speakers available, using persona"
-                                        )
-                            else:
-                                # Fallback when histories is empty
-                                speaker = random.choice(others) if others else p_name
-                                logger.debug(
-                                    f"Turn {t}: Fallback speaker selected: {speaker}"
-                                )
-
-                    logger.debug(f"Turn {t}: Final speaker: {speaker}")
+                            # Nobody else can speak
+                            weights = (1.0, 0.0)
+                        cum_weights = list(accumulate(weights))
+                        choice = bisect(
+                            cum_weights,
+                            draws[t] * cum_weights[-1],
+                            0,
+                            len(cum_weights) - 1,
+                        )
 
-                except Exception as e:
-                    logger.error(f"Turn {t}: Error in speaker selection: {e}")
-                    import traceback
+                        if (
+                            choice != 0
+                            and last_name is not None
+                            and last_history.get("next_speaker") == "myself"
+                        ):
+                            # The last speaker asked to keep talking
+                            speaker = last_name
+                        else:
+                            speaker = population[choice]
+                        logger.debug(
+                            "Turn {}: Speaker selected (choice {}): {}",
+                            t,
+                            choice,
+                            speaker,
+                        )
+
+                    logger.debug("Turn {}: Final speaker: {}", t, speaker)
 
-                    logger.error(
-                        f"Turn {t}: Speaker selection traceback: {traceback.format_exc()}"
+                except Exception as e:
+                    logger.opt(exception=True).error(
+                        f"Turn {t}: Error in speaker selection: {e}"
                     )
                     # Fallback to first role or persona
                     speaker = roles.get(0, p_name)
                     logger.warning(f"Turn {t}: Using fallback speaker: {speaker}")
 
                 # Build prompt
-                hist_msgs = history_to_msgs(histories, speaker, idx_map)
-                prompt = format_hist(hist_msgs, speaker, scenario)
+                hist_msgs = relabel_history_msgs(hist_entries, speaker)
+                # vLLM turns get token ids assembled from cached pieces when
+                # possible; the persona generator needs the text.
+                prompt = None
+                if speaker != p_name and prompt_builder is not None:
+                    prompt = await asyncio.to_thread(
+                        prompt_builder.build_ids,
+                        hist_msgs,
+                        speaker,
+                        scenario,
+                        CHARACTERS.get("speaker", {}).get("tag", ""),
+                    )
+                if prompt is None:
+                    # Rendering can take milliseconds on long histories
+                    prompt = await asyncio.to_thread(
+                        format_hist, hist_msgs, speaker, scenario
+                    )
 
                 # Update probabilities (before await!)
                 if speaker == p_name:
@@ -280,8 +535,10 @@ class ConversationGenerator:
                     emo = speaker_role = nxt = None
                 else:
                     # vLLM path
-                    fut = await self.batcher.put(prompt)
-                    text = await fut
+                    # Cap requests outstanding at the batcher, separately from GPT
+                    async with vllm_semaphore or contextlib.nullcontext():
+                        fut = await self.batcher.put(prompt)
+                        text = await fut
                     # text = (
                     #     CHARACTERS.get(speaker, {}).get("tag", "") + text
                     # )  # Add tag if not present
@@ -309,14 +566,13 @@ class ConversationGenerator:
                         "speaker": speaker_role,
                         "next_speaker": nxt,
                     }
+                    entry_msgs = history_entry_to_msgs(history_entry, idx_map)
                     histories.append(history_entry)
-                    logger.debug(f"Turn {t}: Added history entry for {speaker}")
+                    hist_entries.append(entry_msgs)
+                    logger.debug("Turn {}: Added history entry for {}", t, speaker)
                 except Exception as e:
-                    logger.error(f"Turn {t}: Failed to record history: {e}")
-                    import traceback
-
-                    logger.error(
-                        f"Turn {t}: History recording traceback: {traceback.format_exc()}"
+                    logger.opt(exception=True).error(
+                        f"Turn {t}: Failed to record history: {e}"
                     )
                     # Continue with next turn even if recording failed
 
@@ -336,11 +592,13 @@ class ConversationGenerator:
                 }
             )
 
-            # Mark as completed in database
-            mark_completed(scenario_hash, result, db_file)
+            # Mark as completed in database (batched by the writer thread)
+            await asyncio.wrap_future(submit_completed(scenario_hash, result, db_file))
 
             # Save individual conversation file immediately
-            self._save_individual_conversation(result, conversations_dir)
+            await asyncio.to_thread(
+                self._save_individual_conversation, result, conversations_dir
+            )
 
             logger.info(
                 f"Successfully completed conversation generation with {len(histories)} turns"
@@ -348,21 +606,20 @@ class ConversationGenerator:
             return result
 
         except Exception as e:
-            logger.error(f"Fatal error in conversation generation: {e}")
-            import traceback
-
-            logger.error(f"Conversation generation traceback: {traceback.format_exc()}")
+            logger.opt(exception=True).error(
+                f"Fatal error in conversation generation: {e}"
+            )
             # Mark as failed in database
-            mark_failed(scenario_hash, str(e), db_file)
+            await asyncio.to_thread(mark_failed, scenario_hash, str(e), db_file)
             raise
 
     def _save_individual_conversation(
         self, result: dict[str, Any], conversations_dir: Path
     ):
         """Save individual conversation as JSON file."""
-        import json
-
         conversation_id = result["id"]
         file_path = conversations_dir / f"{conversation_id}.json"
-        with file_path.open("w", encoding="utf-8") as f:
-            json.dump(result, f, ensure_ascii=False, indent=2)
+        # Write a sibling first so readers never see a half-written file
+        tmp_path = file_path.with_suffix(".json.tmp")
+        tmp_path.write_bytes(orjson.dumps(result, option=orjson.OPT_INDENT_2))
+        os.replace(tmp_path, file_path)
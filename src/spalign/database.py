@@ -4,168 +4,315 @@ from __future__ import annotations
 
 import hashlib
 import json
+import queue
 import sqlite3
+import threading
+import time
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Future
+from contextlib import contextmanager
 from typing import Any
 
+# One long-lived connection per database file. Callers run on the event loop
+# thread as well as executor threads, so every use goes through the lock.
+_conn_cache: dict[str, tuple[sqlite3.Connection, threading.Lock]] = {}
+_conn_cache_lock = threading.Lock()
+
+
+def _get_conn(db_file: str) -> tuple[sqlite3.Connection, threading.Lock]:
+    """Return the cached connection for db_file, opening it on first use."""
+    entry = _conn_cache.get(db_file)
+    if entry is None:
+        with _conn_cache_lock:
+            entry = _conn_cache.get(db_file)
+            if entry is None:
+                conn = sqlite3.connect(db_file, check_same_thread=False)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.execute("PRAGMA temp_store=MEMORY")
+                conn.execute("PRAGMA cache_size=-64000")
+                entry = _conn_cache[db_file] = (conn, threading.Lock())
+    return entry
+
+
+@contextmanager
+def _transaction(db_file: str) -> Iterator[sqlite3.Cursor]:
+    """Yield a cursor under the connection lock; commit on success, roll back on error."""
+    conn, lock = _get_conn(db_file)
+    with lock, conn:
+        yield conn.cursor()
+
 
 def init_db(db_file: str) -> None:
     """Initialize SQLite database for progress tracking."""
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS conversations (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            scenario_hash TEXT UNIQUE NOT NULL,
-            status TEXT NOT NULL DEFAULT 'pending',
-            result TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-
-    conn.commit()
-    conn.close()
+    with _transaction(db_file) as cursor:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS conversations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                scenario_hash TEXT UNIQUE NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                result TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
 
 
 def get_scenario_hash(data: dict[str, Any]) -> str:
     """Generate a unique hash for a scenario."""
     scenario_str = json.dumps(data, sort_keys=True, ensure_ascii=False)
-    return hashlib.md5(scenario_str.encode("utf-8")).hexdigest()
+    # Keys of existing progress databases depend on this exact digest, so the
+    # serialization and algorithm stay; MD5 is only an identifier here.
+    return hashlib.md5(scenario_str.encode("utf-8"), usedforsecurity=False).hexdigest()
 
 
-def insert_pending_scenarios(dataset: list[dict[str, Any]], db_file: str) -> None:
-    """Insert all scenarios as pending if not already exists."""
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
+def get_scenario_hashes(dataset: Iterable[dict[str, Any]]) -> list[str]:
+    """Hash every scenario once, in dataset order.
 
-    for data in dataset:
-        scenario_hash = get_scenario_hash(data)
-        cursor.execute(
+    The result can be passed as ``hashes`` to the dataset-scanning helpers
+    below so that a run serializes each scenario only once.
+    """
+    return [get_scenario_hash(data) for data in dataset]
+
+
+def insert_pending_scenarios(
+    dataset: list[dict[str, Any]], db_file: str, hashes: list[str] | None = None
+) -> None:
+    """Insert all scenarios as pending if not already exists."""
+    if hashes is None:
+        hashes = get_scenario_hashes(dataset)
+    with _transaction(db_file) as cursor:
+        cursor.executemany(
             """
             INSERT OR IGNORE INTO conversations (scenario_hash, status)
             VALUES (?, 'pending')
         """,
-            (scenario_hash,),
+            ((scenario_hash,) for scenario_hash in hashes),
         )
 
-    conn.commit()
-    conn.close()
 
+def get_scenarios_with_status(
+    dataset: list[dict[str, Any]],
+    status: str,
+    db_file: str,
+    hashes: list[str] | None = None,
+) -> list[tuple[str, dict[str, Any]]]:
+    """Get ``(scenario_hash, scenario)`` pairs whose row has the given status.
 
-def get_pending_scenarios(
-    dataset: list[dict[str, Any]], db_file: str
-) -> list[dict[str, Any]]:
-    """Get scenarios that are still pending."""
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
+    Returning the hash lets callers hand it on instead of re-serializing the
+    scenario to hash it again.
+    """
+    with _transaction(db_file) as cursor:
+        cursor.execute(
+            "SELECT scenario_hash FROM conversations WHERE status = ?", (status,)
+        )
+        wanted = {row[0] for row in cursor.fetchall()}
 
-    cursor.execute("SELECT scenario_hash FROM conversations WHERE status = 'pending'")
-    pending_hashes = {row[0] for row in cursor.fetchall()}
+    if hashes is None:
+        pairs = ((get_scenario_hash(data), data) for data in dataset)
+        return [(h, data) for h, data in pairs if h in wanted]
+    # Only rows that match are materialized from the dataset
+    return [(h, dataset[i]) for i, h in enumerate(hashes) if h in wanted]
 
-    conn.close()
 
-    return [data for data in dataset if get_scenario_hash(data) in pending_hashes]
+def get_pending_scenarios(
+    dataset: list[dict[str, Any]], db_file: str, hashes: list[str] | None = None
+) -> list[dict[str, Any]]:
+    """Get scenarios that are still pending."""
+    return [
+        data
+        for _, data in get_scenarios_with_status(dataset, "pending", db_file, hashes)
+    ]
 
 
 def mark_completed(scenario_hash: str, result: dict[str, Any], db_file: str) -> None:
     """Mark a scenario as completed and store the result."""
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
+    mark_completed_many([(scenario_hash, result)], db_file)
+
+
+def mark_completed_many(
+    rows: Iterable[tuple[str, dict[str, Any]]], db_file: str
+) -> None:
+    """Mark several scenarios as completed in a single transaction."""
+    # Serialize before taking the connection lock
+    params = [
+        (json.dumps(result, ensure_ascii=False), scenario_hash)
+        for scenario_hash, result in rows
+    ]
+    with _transaction(db_file) as cursor:
+        cursor.executemany(
+            """
+            UPDATE conversations
+            SET status = 'completed', result = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE scenario_hash = ?
+        """,
+            params,
+        )
 
-    cursor.execute(
-        """
-        UPDATE conversations
-        SET status = 'completed', result = ?, updated_at = CURRENT_TIMESTAMP
-        WHERE scenario_hash = ?
-    """,
-        (json.dumps(result, ensure_ascii=False), scenario_hash),
-    )
 
-    conn.commit()
-    conn.close()
+class _CompletionWriter:
+    """Background thread that commits completion updates in batches.
+
+    Updates arriving within ``interval`` seconds of each other share one
+    transaction. Each submission gets a future that resolves once its batch
+    is committed.
+    """
+
+    def __init__(self, db_file: str, interval: float = 0.1):
+        self.db_file = db_file
+        self.interval = interval
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, scenario_hash: str, result: dict[str, Any]) -> Future[None]:
+        fut: Future[None] = Future()
+        self._queue.put((scenario_hash, result, fut))
+        return fut
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.interval
+            while (remaining := deadline - time.monotonic()) > 0:
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                mark_completed_many([(h, r) for h, r, _ in batch], self.db_file)
+            # Database errors and results json cannot serialize; anything else
+            # is a bug and should not be swallowed by the writer
+            except (sqlite3.Error, TypeError, ValueError) as e:
+                for _, _, fut in batch:
+                    fut.set_exception(e)
+            else:
+                for _, _, fut in batch:
+                    fut.set_result(None)
+
+
+_writers: dict[str, _CompletionWriter] = {}
+
+
+def submit_completed(
+    scenario_hash: str, result: dict[str, Any], db_file: str
+) -> Future[None]:
+    """Queue a completion update on the db_file's writer thread.
+
+    Returns a future resolved after the update is committed; await it from
+    async code with ``asyncio.wrap_future``.
+    """
+    writer = _writers.get(db_file)
+    if writer is None:
+        with _conn_cache_lock:
+            writer = _writers.get(db_file)
+            if writer is None:
+                writer = _writers[db_file] = _CompletionWriter(db_file)
+    return writer.submit(scenario_hash, result)
 
 
 def mark_failed(scenario_hash: str, error: str, db_file: str) -> None:
     """Mark a scenario as failed."""
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
-
-    cursor.execute(
-        """
-        UPDATE conversations
-        SET status = 'failed', result = ?, updated_at = CURRENT_TIMESTAMP
-        WHERE scenario_hash = ?
-    """,
-        (json.dumps({"error": error}, ensure_ascii=False), scenario_hash),
-    )
-
-    conn.commit()
-    conn.close()
+    with _transaction(db_file) as cursor:
+        cursor.execute(
+            """
+            UPDATE conversations
+            SET status = 'failed', result = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE scenario_hash = ?
+        """,
+            (json.dumps({"error": error}, ensure_ascii=False), scenario_hash),
+        )
 
 
 def get_completed_results(db_file: str) -> list[dict[str, Any]]:
     """Get all completed conversation results."""
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
+    with _transaction(db_file) as cursor:
+        cursor.execute(
+            "SELECT result FROM conversations WHERE status = 'completed' AND result IS NOT NULL"
+        )
+        rows = cursor.fetchall()
 
-    cursor.execute(
-        "SELECT result FROM conversations WHERE status = 'completed' AND result IS NOT NULL"
-    )
     results = []
-    for row in cursor.fetchall():
+    for row in rows:
         try:
             results.append(json.loads(row[0]))
         except json.JSONDecodeError:
             continue
-
-    conn.close()
     return results
 
 
-def get_progress_stats(db_file: str) -> dict[str, int]:
-    """Get progress statistics."""
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
+def dump_completed_to_parquet(
+    db_file: str, out_path: str, batch_size: int = 1000
+) -> int:
+    """Stream completed results into one zstd-compressed Parquet file.
+
+    Rows carry ``scenario_hash``, ``updated_at`` and the stored ``result`` JSON,
+    so a run's output is a single file instead of one JSON file per
+    conversation. Reads go through a separate read-only connection, which WAL
+    lets run alongside the writers. Returns the number of rows written.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema(
+        [
+            ("scenario_hash", pa.string()),
+            ("updated_at", pa.string()),
+            ("result", pa.string()),
+        ]
+    )
+    n_rows = 0
+    conn = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True)
+    try:
+        cursor = conn.execute(
+            """
+            SELECT scenario_hash, updated_at, result
+            FROM conversations
+            WHERE status = 'completed' AND result IS NOT NULL
+            ORDER BY id
+        """
+        )
+        with pq.ParquetWriter(out_path, schema, compression="zstd") as writer:
+            while rows := cursor.fetchmany(batch_size):
+                columns = list(zip(*rows))
+                writer.write_table(
+                    pa.Table.from_arrays(
+                        [pa.array(c, pa.string()) for c in columns], schema=schema
+                    )
+                )
+                n_rows += len(rows)
+    finally:
+        conn.close()
+    return n_rows
 
-    cursor.execute("""
-        SELECT status, COUNT(*)
-        FROM conversations
-        GROUP BY status
-    """)
 
-    stats = dict(cursor.fetchall())
-    conn.close()
-    return stats
+def get_progress_stats(db_file: str) -> dict[str, int]:
+    """Get progress statistics."""
+    with _transaction(db_file) as cursor:
+        cursor.execute("""
+            SELECT status, COUNT(*)
+            FROM conversations
+            GROUP BY status
+        """)
+        return dict(cursor.fetchall())
 
 
 def get_failed_scenarios(
-    dataset: list[dict[str, Any]], db_file: str
+    dataset: list[dict[str, Any]], db_file: str, hashes: list[str] | None = None
 ) -> list[dict[str, Any]]:
     """Get scenarios that failed previously."""
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
-
-    cursor.execute("SELECT scenario_hash FROM conversations WHERE status = 'failed'")
-    failed_hashes = {row[0] for row in cursor.fetchall()}
-
-    conn.close()
-
-    return [data for data in dataset if get_scenario_hash(data) in failed_hashes]
+    return [
+        data
+        for _, data in get_scenarios_with_status(dataset, "failed", db_file, hashes)
+    ]
 
 
 def reset_failed_to_pending(db_file: str) -> int:
     """Reset all failed scenarios back to pending status for retry."""
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        UPDATE conversations
-        SET status = 'pending', result = NULL, updated_at = CURRENT_TIMESTAMP
-        WHERE status = 'failed'
-    """)
-
-    rows_affected = cursor.rowcount
-    conn.commit()
-    conn.close()
-    return rows_affected
+    with _transaction(db_file) as cursor:
+        cursor.execute("""
+            UPDATE conversations
+            SET status = 'pending', result = NULL, updated_at = CURRENT_TIMESTAMP
+            WHERE status = 'failed'
+        """)
+        return cursor.rowcount
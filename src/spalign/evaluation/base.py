@@ -2,25 +2,41 @@
 
 from __future__ import annotations
 
+import asyncio
+import contextlib
+import functools
+import hashlib
+import heapq
+import itertools
 import json
 import os
 import sqlite3
+import string
 import threading
+import time
 from abc import ABC, abstractmethod
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections.abc import AsyncIterator
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 from typing import Any, Generic, TypeVar
 
-from langchain_core.prompts import ChatPromptTemplate
+import orjson
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_openai import AzureChatOpenAI
+from langchain_openai import AzureChatOpenAI, ChatOpenAI
 from loguru import logger
+from openai import AzureOpenAI
 from pydantic import BaseModel, SecretStr
 from tqdm import tqdm
 
 T = TypeVar("T", bound=BaseModel)
 
+# Threads shared by an evaluator for writing small output files
+IO_WORKERS = 16
+
+# Upper bounds (exclusive) on message count for the dispatch length buckets
+LENGTH_BUCKET_BOUNDS = (10, 25)
+
 
 class DateTimeEncoder(json.JSONEncoder):
     """datetime → ISO8601 で JSON 化"""
@@ -34,9 +50,151 @@ class DateTimeEncoder(json.JSONEncoder):
 class ProgressTracker:
     """Manages database operations for tracking evaluation progress."""
 
+    # Applied once per connection; WAL with synchronous=NORMAL only fsyncs at
+    # checkpoints, and busy_timeout replaces the connect-time timeout
+    PRAGMAS = (
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA temp_store=MEMORY",
+        "PRAGMA mmap_size=268435456",
+        "PRAGMA busy_timeout=30000",
+    )
+
     def __init__(self, db_path: Path, table_suffix: str = ""):
         self.db_path = db_path
         self.table_name = f"progress{table_suffix}"
+        # One connection per worker thread, opened lazily and kept for reuse
+        self._local = threading.local()
+        self._conns: list[sqlite3.Connection] = []
+        self._conns_lock = threading.Lock()
+        self._init_db()
+
+    def _conn(self) -> sqlite3.Connection:
+        """Return this thread's connection, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            for pragma in self.PRAGMAS:
+                conn.execute(pragma)
+            self._local.conn = conn
+            with self._conns_lock:
+                self._conns.append(conn)
+        return conn
+
+    def close(self) -> None:
+        """Close every per-thread connection; later calls reopen lazily."""
+        with self._conns_lock:
+            conns, self._conns = self._conns, []
+            self._local = threading.local()
+        for conn in conns:
+            conn.close()
+
+    def _init_db(self) -> None:
+        """Initialize database schema."""
+        conn = self._conn()
+        conn.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {self.table_name} (
+                session_id    TEXT PRIMARY KEY,
+                processed     INTEGER DEFAULT 0,
+                bad_count     INTEGER DEFAULT 0,
+                cost          REAL    DEFAULT 0,
+                last_updated  TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            """
+        )
+        conn.commit()
+
+    def get_progress(self, session_id: str) -> tuple[bool, int, float] | None:
+        """Get progress for a session. Returns (processed, bad_count, cost) or None."""
+        row = (
+            self._conn()
+            .execute(
+                f"SELECT processed, bad_count, cost FROM {self.table_name} WHERE session_id = ?",
+                (session_id,),
+            )
+            .fetchone()
+        )
+        if row and row[0]:
+            return bool(row[0]), row[1], row[2]
+        return None
+
+    def update_progress(self, session_id: str, bad_count: int, cost: float) -> None:
+        """Update progress for a session."""
+        conn = self._conn()
+        conn.execute(
+            f"""
+            INSERT OR REPLACE INTO {self.table_name} (session_id, processed, bad_count, cost, last_updated)
+            VALUES (?, 1, ?, ?, CURRENT_TIMESTAMP)
+            """,
+            (session_id, bad_count, cost),
+        )
+        conn.commit()
+
+    def get_unprocessed_sessions(
+        self, dataset: list[dict[str, Any]]
+    ) -> list[dict[str, Any]]:
+        """Get list of unprocessed sessions from dataset."""
+        entries_todo = []
+        cur = self._conn().cursor()
+        for entry in dataset:
+            session_id = entry["id"]
+            cur.execute(
+                f"SELECT processed FROM {self.table_name} WHERE session_id = ?",
+                (session_id,),
+            )
+            if not cur.fetchone():
+                entry_copy = dict(entry)
+                entry_copy["id"] = session_id
+                entries_todo.append(entry_copy)
+        return entries_todo
+
+
+class PriorityLimiter:
+    """Concurrency limiter like `asyncio.Semaphore`, but waiters are granted
+    slots lowest key first instead of in arrival order."""
+
+    def __init__(self, value: int):
+        self._value = value
+        self._waiters: list[tuple[Any, int, asyncio.Future[None]]] = []
+        self._counter = itertools.count()
+
+    async def acquire(self, key: Any) -> None:
+        if self._value > 0 and not self._waiters:
+            self._value -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (key, next(self._counter), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Granted a slot just before being cancelled: hand it on
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self) -> None:
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._value += 1
+
+    @contextlib.asynccontextmanager
+    async def slot(self, key: Any = ()) -> AsyncIterator[None]:
+        await self.acquire(key)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class ResponseCache:
+    """Exact-match cache of validated LLM responses keyed by prompt hash."""
+
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
         self._init_db()
 
     def _init_db(self) -> None:
@@ -46,72 +204,59 @@ class ProgressTracker:
         ) as conn:
             conn.execute("PRAGMA journal_mode=WAL")
             conn.execute(
-                f"""
-                CREATE TABLE IF NOT EXISTS {self.table_name} (
-                    session_id    TEXT PRIMARY KEY,
-                    processed     INTEGER DEFAULT 0,
-                    bad_count     INTEGER DEFAULT 0,
-                    cost          REAL    DEFAULT 0,
-                    last_updated  TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                """
+                CREATE TABLE IF NOT EXISTS responses (
+                    key           TEXT PRIMARY KEY,
+                    response      TEXT NOT NULL,
+                    created_at    TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 );
                 """
             )
             conn.commit()
 
-    def get_progress(self, session_id: str) -> tuple[bool, int, float] | None:
-        """Get progress for a session. Returns (processed, bad_count, cost) or None."""
+    @staticmethod
+    def make_key(*parts: str) -> str:
+        """Hash the parts that determine a response into a cache key."""
+        return hashlib.blake2b("\0".join(parts).encode()).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        """Return the cached response JSON for `key`, if any."""
         with sqlite3.connect(
             self.db_path, check_same_thread=False, timeout=30.0
         ) as conn:
-            conn.execute("PRAGMA journal_mode=WAL")
-            cur = conn.cursor()
-            cur.execute(
-                f"SELECT processed, bad_count, cost FROM {self.table_name} WHERE session_id = ?",
-                (session_id,),
-            )
-            row = cur.fetchone()
-            if row and row[0]:
-                return bool(row[0]), row[1], row[2]
-            return None
+            row = conn.execute(
+                "SELECT response FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        return row[0] if row else None
 
-    def update_progress(self, session_id: str, bad_count: int, cost: float) -> None:
-        """Update progress for a session."""
+    def put(self, key: str, response: str) -> None:
+        """Store the response JSON for `key`."""
         with sqlite3.connect(
             self.db_path, check_same_thread=False, timeout=30.0
         ) as conn:
-            conn.execute("PRAGMA journal_mode=WAL")
-            cur = conn.cursor()
-            cur.execute(
-                f"""
-                INSERT OR REPLACE INTO {self.table_name} (session_id, processed, bad_count, cost, last_updated)
-                VALUES (?, 1, ?, ?, CURRENT_TIMESTAMP)
-                """,
-                (session_id, bad_count, cost),
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response) VALUES (?, ?)",
+                (key, response),
             )
             conn.commit()
 
-    def get_unprocessed_sessions(
-        self, dataset: list[dict[str, Any]]
-    ) -> list[dict[str, Any]]:
-        """Get list of unprocessed sessions from dataset."""
-        entries_todo = []
-        with sqlite3.connect(self.db_path, check_same_thread=False) as conn:
-            cur = conn.cursor()
-            for entry in dataset:
-                session_id = entry["id"]
-                cur.execute(
-                    f"SELECT processed FROM {self.table_name} WHERE session_id = ?",
-                    (session_id,),
-                )
-                if not cur.fetchone():
-                    entry_copy = dict(entry)
-                    entry_copy["id"] = session_id
-                    entries_todo.append(entry_copy)
-        return entries_todo
+
+AZURE_DEPLOYMENT = "gpt-4.1"
+AZURE_ENDPOINT = "https://experimental.openai.azure.com"
+AZURE_API_VERSION = "2025-01-01-preview"
+
+# Batch API jobs are billed at half the online price.
+BATCH_COST_FACTOR = 0.5
+BATCH_TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
 
 
 class LLMConfig:
-    """Configuration for LLM instances."""
+    """Configuration for LLM instances.
+
+    `base_url` points the evaluator at a self-hosted OpenAI-compatible server
+    (e.g. vLLM serving an FP8-quantized judge model); it takes precedence over
+    the Azure/Gemini backends. Quantization is a server-side setting.
+    """
 
     def __init__(
         self,
@@ -120,12 +265,14 @@ class LLMConfig:
         max_retries: int = 2,
         timeout: float | None = None,
         model: str | None = None,
+        base_url: str | None = None,
     ):
         self.temperature = temperature
         self.max_tokens = max_tokens
         self.max_retries = max_retries
         self.timeout = timeout
         self.model = model
+        self.base_url = base_url
 
 
 class LLMFactory:
@@ -141,7 +288,21 @@ class LLMFactory:
         if config is None:
             config = LLMConfig()
 
-        if use_azure:
+        if config.base_url:
+            if not config.model:
+                raise ValueError("A model name is required with base_url")
+
+            # vLLM accepts any key unless started with --api-key
+            return ChatOpenAI(
+                model=config.model,
+                base_url=config.base_url,
+                api_key=SecretStr(secret_value=os.getenv("OPENAI_API_KEY", "EMPTY")),
+                temperature=config.temperature,
+                max_tokens=config.max_tokens,
+                timeout=config.timeout,
+                max_retries=config.max_retries,
+            ).with_structured_output(schema, include_raw=True)
+        elif use_azure:
             api_key = os.getenv("AZURE_OPENAI_API_KEY")
             if not api_key:
                 raise ValueError(
@@ -149,9 +310,9 @@ class LLMFactory:
                 )
 
             return AzureChatOpenAI(
-                azure_deployment="gpt-4.1",
-                azure_endpoint="https://experimental.openai.azure.com",
-                api_version="2025-01-01-preview",
+                azure_deployment=AZURE_DEPLOYMENT,
+                azure_endpoint=AZURE_ENDPOINT,
+                api_version=AZURE_API_VERSION,
                 api_key=SecretStr(secret_value=api_key),
                 temperature=config.temperature,
                 max_tokens=config.max_tokens,
@@ -170,6 +331,19 @@ class LLMFactory:
                 api_key=api_key,
             ).with_structured_output(schema, include_raw=True)
 
+    @staticmethod
+    def create_batch_client() -> AzureOpenAI:
+        """Create a raw Azure OpenAI client for Batch API jobs."""
+        api_key = os.getenv("AZURE_OPENAI_API_KEY")
+        if not api_key:
+            raise ValueError("AZURE_OPENAI_API_KEY environment variable is required")
+
+        return AzureOpenAI(
+            azure_endpoint=AZURE_ENDPOINT,
+            api_version=AZURE_API_VERSION,
+            api_key=api_key,
+        )
+
 
 class EvaluationConfig(Generic[T]):
     """Configuration for evaluation."""
@@ -181,12 +355,14 @@ class EvaluationConfig(Generic[T]):
         output_dir: str,
         table_suffix: str = "",
         llm_config: LLMConfig | None = None,
+        response_cache: bool = True,
     ):
         self.schema = schema
         self.prompt_template = prompt_template
         self.output_dir = output_dir
         self.table_suffix = table_suffix
         self.llm_config = llm_config or LLMConfig()
+        self.response_cache = response_cache
 
 
 class BaseEvaluator(Generic[T], ABC):
@@ -202,6 +378,21 @@ class BaseEvaluator(Generic[T], ABC):
         self.progress_tracker = ProgressTracker(
             self.log_dir / f"{config.output_dir}/progress.db", config.table_suffix
         )
+        # Pending LLM calls by cache key, so duplicate prompts share one call
+        self._inflight: dict[str, asyncio.Future[Any]] = {}
+        # Shared across runs so re-evaluating the same conversations is free
+        self.response_cache = (
+            ResponseCache(self.log_dir.parent / "response_cache.db")
+            if config.response_cache
+            else None
+        )
+        self._io_pool = ThreadPoolExecutor(
+            max_workers=IO_WORKERS, thread_name_prefix="io"
+        )
+
+    def close(self) -> None:
+        """Release the progress database connections held by worker threads."""
+        self.progress_tracker.close()
 
     @abstractmethod
     def format_messages(self, messages: list[dict[str, Any]]) -> str:
@@ -250,32 +441,54 @@ class BaseEvaluator(Generic[T], ABC):
                 "cache": 0.075,
             },
         }
+        if model not in COST_TABLE:
+            # Self-hosted models (see LLMConfig.base_url) are not billed per token
+            return 0.0
         return (
             input_tokens * COST_TABLE[model]["input"]
             + output_tokens * COST_TABLE[model]["output"]
             + cache_tokens * COST_TABLE[model]["cache"]
         ) / 1e6
 
-    def process_entry(
-        self,
-        model: str,
-        entry: dict[str, Any],
-        chain: Any,
-        agg_lock: threading.Lock,
-        num_bad_total: list[int],
-        cost_total: list[float],
-    ) -> None:
-        """Process a single conversation entry."""
-        session_id = entry["id"]
+    def parse_response(self, raw: str | bytes) -> T:
+        """Validate a raw JSON LLM response straight into the schema."""
+        # model_validate_json parses and validates in one pass in pydantic-core,
+        # reusing the validator compiled once per model class.
+        return self.config.schema.model_validate_json(raw)
 
-        # Check if already processed
-        progress = self.progress_tracker.get_progress(session_id)
-        if progress:
-            with agg_lock:
-                num_bad_total[0] += progress[1]
-                cost_total[0] += progress[2]
-            return
+    def replay_response(self, raw: str | bytes) -> T:
+        """Rebuild a response from the response cache.
 
+        Cached responses were validated before they were stored, so subclasses
+        may override this to skip validation (e.g. with `model_construct`).
+        """
+        return self.parse_response(raw)
+
+    @staticmethod
+    def write_json(path: Path, data: Any) -> None:
+        """Write `data` to `path` as indented UTF-8 JSON."""
+        # orjson writes UTF-8 directly and handles datetime
+        path.write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+
+    @staticmethod
+    def append_jsonl(path: Path, records: list[dict[str, Any]]) -> None:
+        """Append `records` to `path` as JSON lines in a single write."""
+        payload = b"".join(orjson.dumps(record) + b"\n" for record in records)
+        with open(path, "ab") as f:
+            f.write(payload)
+
+    @staticmethod
+    def length_bucket(entry: dict[str, Any]) -> int:
+        """Coarse size class of an entry by its number of messages."""
+        n = len(entry["conversations"])
+        for bucket, upper in enumerate(LENGTH_BUCKET_BOUNDS):
+            if n < upper:
+                return bucket
+        return len(LENGTH_BUCKET_BOUNDS)
+
+    @staticmethod
+    def dedupe_conversations(entry: dict[str, Any]) -> list[dict[str, Any]]:
+        """Drop messages that repeat the previous message verbatim."""
         convs = []
         prev = None
         for c in entry["conversations"]:
@@ -283,49 +496,218 @@ class BaseEvaluator(Generic[T], ABC):
                 continue
             prev = c["name"] + c["utterance"]
             convs.append(c)
+        return convs
+
+    def prompt_partials(self) -> dict[str, str]:
+        """Template variables that are fixed for the evaluator's lifetime."""
+        return {}
+
+    @functools.cached_property
+    def compiled_prompt(self) -> string.Template:
+        """The prompt template converted once to a `string.Template`."""
+        # Walk the str.format template once: escape literal "$", inline the
+        # static partials and turn each remaining {field} into ${field}, so
+        # rendering is a single regex substitution over per-call fields.
+        partials = self.prompt_partials()
+        parts = []
+        for literal, field, _, _ in string.Formatter().parse(
+            self.config.prompt_template
+        ):
+            parts.append(literal.replace("$", "$$"))
+            if field is None:
+                continue
+            if field in partials:
+                parts.append(partials[field].replace("$", "$$"))
+            else:
+                parts.append(f"${{{field}}}")
+        return string.Template("".join(parts))
+
+    def render_prompt(self, inputs: dict[str, str]) -> str:
+        """Render the evaluation prompt for one set of template variables."""
+        return self.compiled_prompt.substitute(inputs)
+
+    @functools.cached_property
+    def schema_fingerprint(self) -> str:
+        """Stable hash of the response schema, so schema edits miss the cache."""
+        schema_json = json.dumps(self.config.schema.model_json_schema(), sort_keys=True)
+        return hashlib.blake2b(schema_json.encode(), digest_size=16).hexdigest()
+
+    def response_cache_key(self, model: str, prompt: str) -> str:
+        """Cache key for a rendered prompt; the prompt embeds template and inputs."""
+        return ResponseCache.make_key(
+            self.config.schema.__name__, self.schema_fingerprint, model, prompt
+        )
 
-        messages_str = self.format_messages(convs)
-        characters = self.get_characters_from_entry(entry)
+    def build_prompt_inputs(
+        self, entry: dict[str, Any], character: str, messages_str: str
+    ) -> dict[str, str]:
+        """Build the prompt template variables for one (entry, character) pair."""
+        return {
+            "messages": messages_str,
+            "role": character,
+            "role_instruction": self.get_character_profile(character),
+            "scene_instruction": self.get_scene_instruction(entry),
+        }
+
+    def shortcut_response(self, entry: dict[str, Any], character: str) -> T | None:
+        """Return a response without calling the LLM, or None to evaluate.
 
-        local_bad, local_cost = 0, 0.0
+        Subclasses can override this with a cheap local check for entries whose
+        verdict is already clear.
+        """
+        return None
 
-        for character in characters:
+    async def afetch_response(
+        self,
+        model: str,
+        prompt: str,
+        llm: Any,
+        limiter: PriorityLimiter,
+        priority: Any = (),
+    ) -> tuple[T | None, float]:
+        """Get the response for a prompt; returns (response, cost).
+
+        Identical prompts in flight at the same time share one LLM call, and
+        only the caller that made the call is charged for it.
+        """
+        cache_key = self.response_cache_key(model, prompt)
+        while (pending := self._inflight.get(cache_key)) is not None:
             try:
-                data = {
-                    "messages": messages_str,
-                    "role": character,
-                    "role_instruction": self.get_character_profile(character),
-                    "scene_instruction": self.get_scene_instruction(entry),
-                }
-                result = chain.invoke(data)
+                return await asyncio.shield(pending), 0.0
+            except asyncio.CancelledError:
+                # The caller that owned the call was cancelled, not this one:
+                # make the call again (or join whoever already did)
+                if pending.cancelled() and not asyncio.current_task().cancelling():
+                    continue
+                raise
+
+        future: asyncio.Future[T | None] = asyncio.get_running_loop().create_future()
+        self._inflight[cache_key] = future
+        try:
+            cached = None
+            if self.response_cache is not None:
+                cached = await asyncio.to_thread(self.response_cache.get, cache_key)
+
+            cost = 0.0
+            if cached is not None:
+                response = self.replay_response(cached)
+            else:
+                # Only the LLM request itself counts against the in-flight limit
+                async with limiter.slot(priority):
+                    result = await llm.ainvoke(prompt)
 
                 response = result["parsed"]
                 usage = result["raw"].usage_metadata or {}
-                local_cost += self.calculate_cost(model, usage)
+                cost = self.calculate_cost(model, usage)
+
+                if self.response_cache is not None and response is not None:
+                    await asyncio.to_thread(
+                        self.response_cache.put,
+                        cache_key,
+                        response.model_dump_json(),
+                    )
+
+            future.set_result(response)
+            return response, cost
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so a failure nobody else awaited is not re-logged
+            future.exception()
+            raise
+        finally:
+            del self._inflight[cache_key]
 
-                bad_count, corrections = self.process_response(
-                    response, entry, character
+    async def aevaluate_character(
+        self,
+        model: str,
+        entry: dict[str, Any],
+        character: str,
+        messages_str: str,
+        llm: Any,
+        limiter: PriorityLimiter,
+        block: int = 0,
+    ) -> tuple[int, float]:
+        """Evaluate one character of an entry; returns (bad_count, cost)."""
+        session_id = entry["id"]
+        bad_count, cost = 0, 0.0
+        try:
+            response = self.shortcut_response(entry, character)
+            if response is None:
+                data = self.build_prompt_inputs(entry, character, messages_str)
+                prompt = self.render_prompt(data)
+                # Requests for the same character share the template and
+                # profile prefix; granting slots in character order lets a
+                # prefix-caching server (vLLM --enable-prefix-caching) reuse it.
+                # Grouping only applies within a block of entries, so earlier
+                # blocks always finish first and progress keeps moving
+                priority = (block, character, self.length_bucket(entry))
+                response, cost = await self.afetch_response(
+                    model, prompt, llm, limiter, priority
                 )
-                local_bad += bad_count
 
-                # Save corrections to files
-                self.save_corrections(corrections, entry, session_id)
+            bad_count, corrections = self.process_response(response, entry, character)
 
-            except Exception as e:
-                logger.error(f"[{session_id}] invoke error: {e}")
-                continue
+            # Save corrections to files without blocking the event loop
+            await asyncio.to_thread(
+                self.save_corrections, corrections, entry, session_id
+            )
+
+        except Exception as e:
+            logger.error(f"[{session_id}] invoke error: {e}")
+
+        return bad_count, cost
+
+    async def aprocess_entry(
+        self,
+        model: str,
+        entry: dict[str, Any],
+        llm: Any,
+        totals: dict[str, float],
+        limiter: PriorityLimiter,
+        block: int = 0,
+    ) -> None:
+        """Process a single conversation entry; `block` orders its LLM calls."""
+        session_id = entry["id"]
+
+        # Check if already processed
+        progress = await asyncio.to_thread(
+            self.progress_tracker.get_progress, session_id
+        )
+        if progress:
+            totals["bad"] += progress[1]
+            totals["cost"] += progress[2]
+            return
+
+        messages_str = self.format_messages(self.dedupe_conversations(entry))
+        characters = self.get_characters_from_entry(entry)
+
+        # Characters of one entry are independent requests, so fan them out
+        results = await asyncio.gather(
+            *(
+                self.aevaluate_character(
+                    model, entry, character, messages_str, llm, limiter, block
+                )
+                for character in characters
+            )
+        )
+        local_bad = sum(bad for bad, _ in results)
+        local_cost = sum(cost for _, cost in results)
 
         logger.info(f"Session {session_id}: issues={local_bad}, cost={local_cost:.2f}")
 
         try:
-            self.progress_tracker.update_progress(session_id, local_bad, local_cost)
+            await asyncio.to_thread(
+                self.progress_tracker.update_progress, session_id, local_bad, local_cost
+            )
         except sqlite3.Error as e:
             logger.error(f"Database error while saving progress: {e}")
             raise
 
-        with agg_lock:
-            num_bad_total[0] += local_bad
-            cost_total[0] += local_cost
+        totals["bad"] += local_bad
+        totals["cost"] += local_cost
 
     @abstractmethod
     def get_character_profile(self, character: str) -> str:
@@ -344,59 +726,245 @@ class BaseEvaluator(Generic[T], ABC):
         """Save corrections to output files."""
         pass
 
-    def run_evaluation(
+    async def arun_evaluation(
         self,
         model: str,
         dataset: Any,
         max_items: int | None = None,
-        max_workers: int = 8,
+        max_concurrency: int = 128,
         use_azure: bool = False,
     ) -> None:
-        """Run parallel evaluation on dataset."""
+        """Run concurrent evaluation; `max_concurrency` caps in-flight LLM calls."""
         logger.info(f"Logging to {self.output_dir}")
 
-        # Setup parser and prompt
-        prompt_tpl = ChatPromptTemplate.from_template(self.config.prompt_template)
+        # A single LLM client is shared by all requests; prompts are rendered
+        # with the precompiled template and sent as one user message
+        llm = LLMFactory.create_llm(
+            self.config.schema, use_azure, self.config.llm_config
+        )
 
-        # Thread-safe aggregation variables
-        agg_lock = threading.Lock()
-        num_bad_total = [0]
-        cost_total = [0.0]
-
-        def process_entry_wrapper(model: str, entry: dict[str, Any]) -> None:
-            """Wrapper to create per-thread LLM instance."""
-            llm = LLMFactory.create_llm(
-                self.config.schema, use_azure, self.config.llm_config
-            )
-            chain = prompt_tpl | llm
-            self.process_entry(model, entry, chain, agg_lock, num_bad_total, cost_total)
+        # Aggregation is only touched from the event loop, so no lock is needed
+        totals = {"bad": 0, "cost": 0.0}
+        limiter = PriorityLimiter(max_concurrency)
 
         # Get unprocessed entries
-        entries_todo = self.progress_tracker.get_unprocessed_sessions(list(dataset))
-
-        # Run parallel processing
-        futures = []
-        cancelled = False
-
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            for entry in entries_todo:
-                futures.append(executor.submit(process_entry_wrapper, model, entry))
-
-            logger.info(f"Processing {len(futures)} entries")
-            for fut in tqdm(as_completed(futures), total=len(futures)):
-                if (
-                    max_items is not None
-                    and num_bad_total[0] > max_items
-                    and not cancelled
-                ):
-                    logger.info(
-                        f"サンプル数が上限 {max_items} を超えたため残ジョブをキャンセルします…"
+        entries_todo = await asyncio.to_thread(
+            self.progress_tracker.get_unprocessed_sessions, list(dataset)
+        )
+        # Dispatch in length buckets, shortest first, so requests that are in
+        # flight together have similar prompt sizes (stable within a bucket)
+        entries_todo.sort(key=self.length_bucket)
+
+        logger.info(f"Processing {len(entries_todo)} entries")
+
+        # Only a window of entries is in flight at a time, numbered in blocks
+        # of the same size; entries finish (and reach progress.db) steadily
+        # and the `max_items` cutoff is checked before later calls are sent
+        window = max(1, max_concurrency)
+        pending = iter(enumerate(entries_todo))
+        active: set[asyncio.Future[None]] = set()
+        stop = False
+        try:
+            with tqdm(total=len(entries_todo)) as pbar:
+                while not stop:
+                    for ordinal, entry in itertools.islice(
+                        pending, window - len(active)
+                    ):
+                        active.add(
+                            asyncio.ensure_future(
+                                self.aprocess_entry(
+                                    model,
+                                    entry,
+                                    llm,
+                                    totals,
+                                    limiter,
+                                    ordinal // window,
+                                )
+                            )
+                        )
+                    if not active:
+                        break
+
+                    done, active = await asyncio.wait(
+                        active, return_when=asyncio.FIRST_COMPLETED
                     )
-                    cancelled = True
-                    for f in futures:
-                        f.cancel()
-                    break
+                    for fut in done:
+                        pbar.update()
+                        try:
+                            fut.result()
+                        except asyncio.CancelledError:
+                            logger.error("Entry processing was cancelled")
+                        except Exception as e:
+                            logger.error(f"Entry processing failed: {e}")
+
+                    if max_items is not None and totals["bad"] > max_items:
+                        logger.info(
+                            f"サンプル数が上限 {max_items} を超えたため残ジョブをキャンセルします…"
+                        )
+                        stop = True
+        finally:
+            for task in active:
+                task.cancel()
+            await asyncio.gather(*active, return_exceptions=True)
+            self.close()
 
         logger.success(
-            f"Finished! Issues found: {num_bad_total[0]}, Total cost: {cost_total[0]:.2f} yen"
+            f"Finished! Issues found: {totals['bad']}, Total cost: {totals['cost']:.2f} yen"
         )
+
+    def run_evaluation(
+        self,
+        model: str,
+        dataset: Any,
+        max_items: int | None = None,
+        max_workers: int = 8,
+        use_azure: bool = False,
+    ) -> None:
+        """Run evaluation on dataset; `max_workers` bounds in-flight LLM calls."""
+        asyncio.run(
+            self.arun_evaluation(
+                model,
+                dataset,
+                max_items=max_items,
+                max_concurrency=max_workers,
+                use_azure=use_azure,
+            )
+        )
+
+    def build_batch_requests(
+        self, entries: list[dict[str, Any]]
+    ) -> tuple[list[dict[str, Any]], dict[str, tuple[str, str]]]:
+        """Build one Batch API request per (entry, character) pair.
+
+        Returns the requests and a map from each `custom_id` to its
+        (session_id, character), so neither has to be parsed back out.
+        """
+        llm_config = self.config.llm_config
+        response_format = {
+            "type": "json_schema",
+            "json_schema": {
+                "name": self.config.schema.__name__,
+                "schema": self.config.schema.model_json_schema(),
+            },
+        }
+
+        requests = []
+        targets: dict[str, tuple[str, str]] = {}
+        for entry in entries:
+            messages_str = self.format_messages(self.dedupe_conversations(entry))
+            for character in self.get_characters_from_entry(entry):
+                data = self.build_prompt_inputs(entry, character, messages_str)
+                body: dict[str, Any] = {
+                    "model": AZURE_DEPLOYMENT,
+                    "messages": [{"role": "user", "content": self.render_prompt(data)}],
+                    "temperature": llm_config.temperature,
+                    "response_format": response_format,
+                }
+                if llm_config.max_tokens is not None:
+                    body["max_tokens"] = llm_config.max_tokens
+                custom_id = f"request-{len(requests)}"
+                targets[custom_id] = (entry["id"], character)
+                requests.append(
+                    {
+                        "custom_id": custom_id,
+                        "method": "POST",
+                        "url": "/chat/completions",
+                        "body": body,
+                    }
+                )
+        return requests, targets
+
+    def run_batch_evaluation(
+        self,
+        model: str,
+        dataset: Any,
+        poll_interval: float = 30.0,
+        max_poll_interval: float = 600.0,
+    ) -> None:
+        """Run evaluation through the Azure OpenAI Batch API."""
+        logger.info(f"Logging to {self.output_dir}")
+
+        try:
+            entries_todo = self.progress_tracker.get_unprocessed_sessions(list(dataset))
+            entries_by_id = {entry["id"]: entry for entry in entries_todo}
+            requests, targets = self.build_batch_requests(entries_todo)
+            if not requests:
+                logger.info("No entries to evaluate")
+                return
+
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            batch_input = self.output_dir.parent / f"batch_input_{timestamp}.jsonl"
+            with open(batch_input, "w") as f:
+                for request in requests:
+                    f.write(json.dumps(request, ensure_ascii=False) + "\n")
+
+            client = LLMFactory.create_batch_client()
+            with open(batch_input, "rb") as f:
+                input_file = client.files.create(file=f, purpose="batch")
+            batch = client.batches.create(
+                input_file_id=input_file.id,
+                endpoint="/chat/completions",
+                completion_window="24h",
+            )
+            logger.info(f"Submitted batch {batch.id} with {len(requests)} requests")
+
+            # Poll with exponential backoff until the job reaches a terminal state
+            delay = poll_interval
+            while batch.status not in BATCH_TERMINAL_STATUSES:
+                time.sleep(delay)
+                delay = min(delay * 2, max_poll_interval)
+                batch = client.batches.retrieve(batch.id)
+                logger.info(f"Batch {batch.id}: {batch.status}")
+
+            if batch.status != "completed" or not batch.output_file_id:
+                logger.error(f"Batch {batch.id} ended with status {batch.status}")
+                return
+
+            output = client.files.content(batch.output_file_id).text
+
+            totals: dict[str, dict[str, float]] = {}
+            for line in output.splitlines():
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                session_id, character = targets[record["custom_id"]]
+                entry = entries_by_id[session_id]
+                session_totals = totals.setdefault(session_id, {"bad": 0, "cost": 0.0})
+
+                try:
+                    body = record["response"]["body"]
+                    usage = body.get("usage") or {}
+                    session_totals["cost"] += BATCH_COST_FACTOR * self.calculate_cost(
+                        model,
+                        {
+                            "input_tokens": usage.get("prompt_tokens", 0),
+                            "output_tokens": usage.get("completion_tokens", 0),
+                            "input_token_details": {
+                                "cache_read": (
+                                    usage.get("prompt_tokens_details") or {}
+                                ).get("cached_tokens", 0)
+                            },
+                        },
+                    )
+                    response = self.parse_response(
+                        body["choices"][0]["message"]["content"]
+                    )
+                    bad_count, corrections = self.process_response(
+                        response, entry, character
+                    )
+                    session_totals["bad"] += bad_count
+                    self.save_corrections(corrections, entry, session_id)
+                except Exception as e:
+                    logger.error(f"[{session_id}] batch result error: {e}")
+                    continue
+
+            for session_id, session_totals in totals.items():
+                self.progress_tracker.update_progress(
+                    session_id, int(session_totals["bad"]), session_totals["cost"]
+                )
+        finally:
+            self.close()
+
+        num_bad = sum(int(t["bad"]) for t in totals.values())
+        cost = sum(t["cost"] for t in totals.values())
+        logger.success(f"Finished! Issues found: {num_bad}, Total cost: {cost:.2f} yen")
@@ -5,10 +5,14 @@ from __future__ import annotations
 import re
 from typing import Any
 
+_NEXT_SPEAKER_RE = re.compile(r"\[next:([^\]]*)\]")
+_LAZY_TAG_RE = re.compile(r"\[.*?\]")
+_TAG_RE = re.compile(r"\[([^\]]+)\]")
+
 
 def strip_tags(text: str) -> str:
     """Remove [tag] patterns used for emotion etc."""
-    return re.sub(r"\[.*?\]", "", text)
+    return _LAZY_TAG_RE.sub("", text)
 
 
 def parse_role(characters: list[str], persona_name: str) -> dict[int, str]:
@@ -18,18 +22,37 @@ def parse_role(characters: list[str], persona_name: str) -> dict[int, str]:
     return roles
 
 
+def history_entry_to_msgs(
+    h: dict[str, Any], idx_map: dict[str, int]
+) -> tuple[str, dict[str, str], dict[str, str]]:
+    """Both chat messages a history entry can become: ``(name, as_self, as_other)``.
+
+    ``as_self`` is used when the entry's speaker is the one being prompted,
+    ``as_other`` otherwise. Converting each entry once lets callers relabel a
+    growing history per turn without re-stripping every utterance.
+    """
+    idx = idx_map[h["name"]]
+    return (
+        h["name"],
+        {"role": "assistant", "content": h["utterance"]},
+        {"role": f"user_{idx:02d}", "content": strip_tags(h["utterance"])},
+    )
+
+
 def history_to_msgs(hist: list[dict[str, Any]], speaker: str, idx_map: dict[str, int]):
     """Convert history into Llama‑3 chat‑template friendly list."""
-    msgs: list[dict[str, str]] = []
-    for h in hist:
-        idx = idx_map[h["name"]]
-        if h["name"] != speaker:
-            msgs.append(
-                {"role": f"user_{idx:02d}", "content": strip_tags(h["utterance"])}
-            )
-        else:
-            msgs.append({"role": "assistant", "content": h["utterance"]})
-    return msgs
+    return relabel_history_msgs(
+        [history_entry_to_msgs(h, idx_map) for h in hist], speaker
+    )
+
+
+def relabel_history_msgs(
+    entries: list[tuple[str, dict[str, str], dict[str, str]]], speaker: str
+) -> list[dict[str, str]]:
+    """Pick each converted entry's message for the current speaker."""
+    return [
+        as_self if name == speaker else as_other for name, as_self, as_other in entries
+    ]
 
 
 def parse_utterance(text: str):
@@ -38,7 +61,7 @@ def parse_utterance(text: str):
     next_speaker = "[next:user_00]"  # デフォルト
 
     # 全ての [xxx] タグを抽出
-    tags = list(re.finditer(r"\[([^\]]+)\]", text))
+    tags = list(_TAG_RE.finditer(text))
 
     for tag in tags:
         full_tag = tag.group(0)  # 例: "[cammy]"
@@ -52,13 +75,13 @@ def parse_utterance(text: str):
             speaker = full_tag
 
     # remove tags
-    cleaned_text = re.sub(r"\[[^]]+\]", "", text)
+    cleaned_text = _TAG_RE.sub("", text)
 
     return speaker, emotion, cleaned_text, next_speaker
 
 
 def extract_next_speaker(text: str) -> str:
-    match = re.search(r"\[next:(.*?)\]", text)
+    match = _NEXT_SPEAKER_RE.search(text)
     if match:
         return match.group(1).strip()
     return "user_00"